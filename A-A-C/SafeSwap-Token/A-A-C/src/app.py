@@ -1,52 +1,242 @@
-from flask import Flask, request, jsonify
-import pandas as pd
-import joblib
-import numpy as np
-import lime
-import lime.lime_tabular
+from flask import Flask, jsonify
+from contextlib import contextmanager
+import atexit
+import threading
+import time
 import os
+import queue
 import logging # Thêm import logging
-from logging.handlers import RotatingFileHandler # Thêm import này
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener # Thêm import này
+
+try:
+    from RugPullDetectionModel.wire_format import request_body, respond, unsupported_media_type
+    from RugPullDetectionModel.prediction_logger import PredictionLogger
+except ImportError:
+    from wire_format import request_body, respond, unsupported_media_type
+    from prediction_logger import PredictionLogger
 
 app = Flask(__name__)
 app.config['JSON_AS_ASCII'] = False # QUAN TRỌNG: Để hiển thị emoji đúng
 
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full."""
+
+    def __init__(self, queue_):
+        super().__init__(queue_)
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+
+def setup_file_logging():
+    # Gắn handler ngay khi import để gunicorn (không chạy __main__) cũng ghi log.
+    # Request thread chỉ đẩy record vào hàng đợi; QueueListener ghi file ở thread riêng.
+    # Mỗi worker gunicorn ghi file riêng (theo pid) để việc xoay vòng file không bị tranh chấp.
+    log_queue = queue.Queue(maxsize=10000)
+
+    file_handler = RotatingFileHandler(f'flask_app-{os.getpid()}.log', maxBytes=1024 * 1024 * 100, backupCount=20)
+    file_handler.setLevel(logging.ERROR)
+    formatter = logging.Formatter("[%(asctime)s] {%(pathname)s:%(lineno)d} %(levelname)s - %(message)s")
+    file_handler.setFormatter(formatter)
+
+    listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    # Ghi nốt các record còn trong hàng đợi khi worker dừng
+    atexit.register(listener.stop)
+
+    queue_handler = DroppingQueueHandler(log_queue)
+    app.logger.addHandler(queue_handler)
+    # Quan trọng: đặt level cho logger của app để file_handler có tác dụng
+    app.logger.setLevel(logging.INFO)
+    return listener, queue_handler
+
+
+log_listener, log_queue_handler = setup_file_logging()
+
+# Ghi log mỗi dự đoán (input features + kết quả), mỗi worker một file NDJSON (để trống để tắt)
+PREDICTION_LOG_DIR = os.environ.get('PREDICTION_LOG_DIR', 'prediction_logs')
+prediction_logger = PredictionLogger(PREDICTION_LOG_DIR) if PREDICTION_LOG_DIR else None
+if prediction_logger is not None:
+    prediction_logger.start()
+
+
+def log_prediction(record):
+    if prediction_logger is not None:
+        prediction_logger.log(record)
+
+# joblib, numpy, lime được import và model/scaler/LIME được tải trong thread nền
+# (xem load_service) để service trả lời /health ngay khi khởi động.
+_import_started = time.perf_counter()
+
 # Load model & scaler
 MODEL_PATH = 'RugPullDetectionModel/isolation_forest_model_new_data.joblib'
 SCALER_PATH = 'RugPullDetectionModel/scaler_new_data.pkl'
-
-model = joblib.load(MODEL_PATH)
-scaler = joblib.load(SCALER_PATH)
+# Scaler + model biên dịch sang NumPy (export_compiled_model.py), dùng cho dự đoán từng dòng
+COMPILED_MODEL_PATH = 'RugPullDetectionModel/isolation_forest_model_new_data.compiled.npz'
+USE_COMPILED_MODEL = os.environ.get('USE_COMPILED_MODEL', '1') != '0'
+# Model biên dịch chỉ nhanh hơn sklearn với batch nhỏ
+COMPILED_MAX_ROWS = 128
+BATCH_MAX_ROWS = int(os.environ.get('BATCH_MAX_ROWS', 1000))
 
 OPTIMAL_THRESHOLD = 0.2059 # found in code
 
+np = None
+model = None
+scaler = None
+compiled_model = None
+explainer = None
+feature_names_for_lime = []
+startup_error = None
 
-try:
-    feature_names_for_lime = scaler.feature_names_in_.tolist()
-except AttributeError:
-    print("Warning: scaler.feature_names_in_ not available. Manually defining feature names based on notebook context.")
-    num_features_from_notebook = 19 # Giả sử đây là số lượng features từ notebook của bạn
-    feature_names_for_lime = [f"feature_{i+1}" for i in range(num_features_from_notebook)]
-
-num_training_features = len(feature_names_for_lime)
+model_ready = threading.Event()
+STARTUP_TIMINGS = {}
 
-# Tạo dữ liệu huấn luyện giả lập cho LIME, nên thay thế bằng dữ liệu thực hoặc mẫu từ dữ liệu huấn luyện gốc nếu có
-dummy_training_data_for_lime = np.random.rand(100, num_training_features)
-print(f"LIME Explainer initialized with {num_training_features} features: {feature_names_for_lime[:5]}...")
 
+@contextmanager
+def startup_phase(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STARTUP_TIMINGS[name] = round(time.perf_counter() - started, 4)
 
-class_names_for_lime = ['Anomaly', 'Normal'] # 0: Anomaly (-1 model), 1: Normal (1 model)
 
-explainer = lime.lime_tabular.LimeTabularExplainer(
-    training_data=dummy_training_data_for_lime, # Nên là dữ liệu huấn luyện đã được scale
-    feature_names=feature_names_for_lime,
-    class_names=class_names_for_lime,
-    mode='classification', # 'regression' nếu model dự đoán giá trị liên tục, 'classification' cho nhãn
-    verbose=False,
-    random_state=42 # Để kết quả có thể tái tạo
-)
+def load_service():
+    """Imports the heavy libraries, loads model and scaler and builds the LIME explainer."""
+    global np, model, scaler, compiled_model, explainer, feature_names_for_lime, startup_error
 
-# Hàm dự đoán cho LIME
+    try:
+        with startup_phase('import_libraries'):
+            import joblib
+            import numpy as np
+            import lime.lime_tabular
+            try:
+                from RugPullDetectionModel.compiled_model import load_compiled_model
+            except ImportError:
+                from compiled_model import load_compiled_model
+
+        with startup_phase('load_model'):
+            model = joblib.load(MODEL_PATH)
+            scaler = joblib.load(SCALER_PATH)
+            if USE_COMPILED_MODEL and os.path.exists(COMPILED_MODEL_PATH):
+                compiled_model = load_compiled_model(COMPILED_MODEL_PATH)
+                print(f"Compiled model loaded from: {COMPILED_MODEL_PATH}")
+
+        with startup_phase('build_explainer'):
+            try:
+                names = scaler.feature_names_in_.tolist()
+            except AttributeError:
+                print("Warning: scaler.feature_names_in_ not available. Manually defining feature names based on notebook context.")
+                num_features_from_notebook = 19 # Giả sử đây là số lượng features từ notebook của bạn
+                names = [f"feature_{i+1}" for i in range(num_features_from_notebook)]
+
+            num_training_features = len(names)
+
+            # Tạo dữ liệu huấn luyện giả lập cho LIME, nên thay thế bằng dữ liệu thực hoặc mẫu từ dữ liệu huấn luyện gốc nếu có
+            dummy_training_data_for_lime = np.random.rand(100, num_training_features)
+            print(f"LIME Explainer initialized with {num_training_features} features: {names[:5]}...")
+
+            class_names_for_lime = ['Anomaly', 'Normal'] # 0: Anomaly (-1 model), 1: Normal (1 model)
+
+            explainer = lime.lime_tabular.LimeTabularExplainer(
+                training_data=dummy_training_data_for_lime, # Nên là dữ liệu huấn luyện đã được scale
+                feature_names=names,
+                class_names=class_names_for_lime,
+                mode='classification', # 'regression' nếu model dự đoán giá trị liên tục, 'classification' cho nhãn
+                verbose=False,
+                random_state=42 # Để kết quả có thể tái tạo
+            )
+            feature_names_for_lime = names
+    except Exception as e:
+        startup_error = str(e)
+        app.logger.error(f"Service failed to start: {str(e)}")
+    finally:
+        STARTUP_TIMINGS['total'] = round(time.perf_counter() - _import_started, 4)
+        print(f"Startup timings (s): {STARTUP_TIMINGS}")
+        model_ready.set()
+
+
+def service_unavailable():
+    """Error response for requests that need the model, or None when it is usable."""
+    if not model_ready.is_set():
+        return jsonify({"error": "Model is still loading"}), 503
+    if startup_error is not None:
+        return jsonify({"error": f"Model is not available: {startup_error}"}), 500
+    return None
+
+
+threading.Thread(target=load_service, name='model-loader', daemon=True).start()
+
+
+def score_rows(rows):
+    """Scales raw feature rows and returns (scaled rows, anomaly scores)."""
+    if compiled_model is not None and len(rows) <= COMPILED_MAX_ROWS:
+        rows_scaled = compiled_model.transform(rows)
+        return rows_scaled, compiled_model.decision_function(rows_scaled)
+    rows_scaled = scaler.transform(rows)
+    return rows_scaled, model.decision_function(rows_scaled)
+
+
+def classify_score(score_value):
+    """Returns (label code, label string, message) for an anomaly score."""
+    if score_value < OPTIMAL_THRESHOLD:
+        return -1, "Anomaly", "Anomaly - Rug Pull Project! 🚨"
+    return 1, "Normal", "Normal - Quite safe project."
+
+
+def require_finite(rows):
+    """
+    Returns `rows` if every value is finite. null (NaN) and infinite values
+    raise ValueError: the compiled model would score them silently.
+    """
+    finite = np.isfinite(rows)
+    if not finite.all():
+        bad = [feature for feature, ok in zip(feature_names_for_lime, finite.all(axis=0)) if not ok]
+        raise ValueError(f"Missing (null) or infinite values for features: {', '.join(bad)}")
+    return rows
+
+
+def batch_rows(data):
+    """
+    Feature matrix of a batch request, either {"rows": [{feature: value}, ...]}
+    or the compact {"columns": [feature, ...], "rows": [[value, ...], ...]}.
+    Raises ValueError describing what is wrong with the input.
+    """
+    rows = data.get('rows') if isinstance(data, dict) else None
+    if not isinstance(rows, list) or not rows:
+        raise ValueError("Missing rows list in request body")
+    if len(rows) > BATCH_MAX_ROWS:
+        raise ValueError(f"Too many rows in one batch (max {BATCH_MAX_ROWS})")
+
+    columns = data.get('columns')
+    if columns is None:
+        if not all(isinstance(row, dict) for row in rows):
+            raise ValueError("Rows must be objects when no columns are given")
+        missing_features = sorted({feature for row in rows for feature in feature_names_for_lime if feature not in row})
+        if missing_features:
+            raise ValueError(f"Missing features in input data: {', '.join(missing_features)}")
+        return require_finite(np.array([[row[feature] for feature in feature_names_for_lime] for row in rows],
+                                       dtype=np.float64))
+
+    if not isinstance(columns, list):
+        raise ValueError("columns must be a list of feature names")
+    missing_features = [feature for feature in feature_names_for_lime if feature not in columns]
+    if missing_features:
+        raise ValueError(f"Missing features in input data: {', '.join(missing_features)}")
+    if not all(isinstance(row, list) and len(row) == len(columns) for row in rows):
+        raise ValueError("Every row must be a list with one value per column")
+    order = [columns.index(feature) for feature in feature_names_for_lime]
+    return require_finite(np.array(rows, dtype=np.float64)[:, order])
+
+
+# Hàm dự đoán cho LIME (LIME gửi hàng nghìn dòng nên dùng model sklearn)
 # Input: X_lime_input_np (numpy array)
 # Output: numpy array có shape (n_samples, n_classes) với xác suất cho mỗi lớp
 def lime_predict_fn(X_lime_input_np):
@@ -62,40 +252,52 @@ def lime_predict_fn(X_lime_input_np):
 def home():
     return "Liquidity Anomaly Detection API - Optimized Threshold with LIME"
 
+@app.route('/health', methods=['GET'])
+def health():
+    return jsonify({
+        "status": "OK",
+        "model_loaded": model is not None,
+        "prediction_log": prediction_logger.status() if prediction_logger is not None else None,
+        "app_log_dropped": log_queue_handler.dropped
+    })
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    is_ready = model_ready.is_set() and startup_error is None
+    return jsonify({
+        "ready": is_ready,
+        "loading": not model_ready.is_set(),
+        "error": startup_error,
+        "startup_timings": STARTUP_TIMINGS
+    }), 200 if is_ready else 503
+
 @app.route('/predict', methods=['POST'])
 def predict():
-    try:
-        data = request.get_json()
-        if not data:
-            return jsonify({"error": "No input data provided"}), 400
+    unavailable = service_unavailable() or unsupported_media_type()
+    if unavailable is not None:
+        return unavailable
 
-        try:
-            df = pd.DataFrame([data], columns=feature_names_for_lime)
-        except ValueError as ve:
-            return jsonify({"error": f"Input data error or incorrect columns: {str(ve)}"}), 400
+    try:
+        data = request_body()
+        if not data or not isinstance(data, dict):
+            return respond({"error": "No input data provided"}, 400)
 
         missing_features = [feature for feature in feature_names_for_lime if feature not in data]
         if missing_features:
-            return jsonify({"error": f"Missing features in input data: {', '.join(missing_features)}"}), 400
+            return respond({"error": f"Missing features in input data: {', '.join(missing_features)}"}, 400)
 
-        df = df[feature_names_for_lime]
-        df_scaled = scaler.transform(df.values)
+        try:
+            row = require_finite(np.array([[data[feature] for feature in feature_names_for_lime]], dtype=np.float64))
+        except (TypeError, ValueError) as ve:
+            return respond({"error": f"Input data error or incorrect columns: {str(ve)}"}, 400)
 
-        anomaly_score = model.decision_function(df_scaled)
+        row_scaled, anomaly_score = score_rows(row)
         score_value = anomaly_score[0]
-
-        if score_value < OPTIMAL_THRESHOLD:
-            prediction_label = -1
-            prediction_string = "Anomaly"
-            warning = "Anomaly - Rug Pull Project! 🚨"
-        else:
-            prediction_label = 1
-            prediction_string = "Normal"
-            warning = "Normal - Quite safe project."
+        prediction_label, prediction_string, warning = classify_score(score_value)
 
         lime_explanation_list = []
         try:
-            instance_to_explain_np = df_scaled[0]
+            instance_to_explain_np = row_scaled[0]
             predicted_class_index_lime = 0 if prediction_label == -1 else 1
             explanation = explainer.explain_instance(
                 data_row=instance_to_explain_np,
@@ -108,7 +310,13 @@ def predict():
             app.logger.error(f"LIME explanation error: {str(lime_e)}")
             lime_explanation_list = [{"error": f"Could not generate LIME explanation: {str(lime_e)}"}]
 
-        return jsonify({
+        log_prediction({
+            **{feature: data[feature] for feature in feature_names_for_lime},
+            "anomaly_score": float(score_value),
+            "prediction_label_code": prediction_label
+        })
+
+        return respond({
             "prediction_label_code": prediction_label,
             "prediction_label_string": prediction_string,
             "prediction_message": warning,
@@ -117,13 +325,52 @@ def predict():
         })
 
     except KeyError as ke:
-        return jsonify({"error": f"Missing feature in input data: {str(ke)}"}), 400
+        return respond({"error": f"Missing feature in input data: {str(ke)}"}, 400)
     except Exception as e:
         app.logger.error(f"Error during prediction: {str(e)}")
-        return jsonify({"error": f"An unexpected error occurred: {str(e)}"}), 500
+        return respond({"error": f"An unexpected error occurred: {str(e)}"}, 500)
+
+# Dự đoán nhiều pool trong một request (không có giải thích LIME, dùng /predict cho từng pool)
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch():
+    unavailable = service_unavailable() or unsupported_media_type()
+    if unavailable is not None:
+        return unavailable
+
+    data = request_body()
+    try:
+        rows = batch_rows(data)
+    except (TypeError, ValueError) as ve:
+        return respond({"error": f"Input data error or incorrect columns: {str(ve)}"}, 400)
+
+    try:
+        _, anomaly_scores = score_rows(rows)
+    except Exception as e:
+        app.logger.error(f"Error during batch prediction: {str(e)}")
+        return respond({"error": f"An unexpected error occurred: {str(e)}"}, 500)
+
+    results = []
+    for row, score_value in zip(rows.tolist(), anomaly_scores.tolist()):
+        prediction_label, prediction_string, warning = classify_score(score_value)
+        log_prediction({
+            **dict(zip(feature_names_for_lime, row)),
+            "anomaly_score": score_value,
+            "prediction_label_code": prediction_label
+        })
+        results.append({
+            "prediction_label_code": prediction_label,
+            "prediction_label_string": prediction_string,
+            "prediction_message": warning,
+            "anomaly_score": score_value
+        })
+    return respond({"results": results, "count": len(results)})
 
 @app.route('/test-sample', methods=['GET'])
 def test_sample():
+    unavailable = service_unavailable()
+    if unavailable is not None:
+        return unavailable
+
     sample_input = {
         'TOTAL_ADDED_LIQUIDITY':  50000,
         'TOTAL_REMOVED_LIQUIDITY': 50000,
@@ -150,11 +397,8 @@ def test_sample():
         if feature not in sample_input:
             sample_input[feature] = 0
 
-    df = pd.DataFrame([sample_input], columns=feature_names_for_lime)
-    df = df[feature_names_for_lime]
-    df_scaled = scaler.transform(df.values)
-
-    anomaly_score_test = model.decision_function(df_scaled)
+    row = np.array([[sample_input[feature] for feature in feature_names_for_lime]], dtype=np.float64)
+    row_scaled, anomaly_score_test = score_rows(row)
     score_value_test = anomaly_score_test[0]
 
     if score_value_test < OPTIMAL_THRESHOLD:
@@ -168,7 +412,7 @@ def test_sample():
 
     lime_explanation_list_test = []
     try:
-        instance_to_explain_np = df_scaled[0]
+        instance_to_explain_np = row_scaled[0]
         predicted_class_index_lime = 0 if prediction_label_test == -1 else 1
         explanation = explainer.explain_instance(
             data_row=instance_to_explain_np,
@@ -190,45 +434,6 @@ def test_sample():
         "lime_explanation": lime_explanation_list_test
     })
 
-# ... (phần định nghĩa feature_names_for_lime, explainer, lime_predict_fn) ...
-# Tôi sẽ giả định phần này đã có ở trên và đúng
-try:
-    feature_names_for_lime = scaler.feature_names_in_.tolist()
-except AttributeError:
-    print("Warning: scaler.feature_names_in_ not available. Manually defining feature names based on notebook context.")
-    num_features_from_notebook = 19
-    feature_names_for_lime = [f"feature_{i+1}" for i in range(num_features_from_notebook)]
-
-num_training_features = len(feature_names_for_lime)
-dummy_training_data_for_lime = np.random.rand(100, num_training_features)
-print(f"LIME Explainer initialized with {num_training_features} features: {feature_names_for_lime[:5]}...")
-class_names_for_lime = ['Anomaly', 'Normal']
-
-explainer = lime.lime_tabular.LimeTabularExplainer(
-    training_data=dummy_training_data_for_lime,
-    feature_names=feature_names_for_lime,
-    class_names=class_names_for_lime,
-    mode='classification',
-    verbose=False,
-    random_state=42
-)
-
-def lime_predict_fn(X_lime_input_np):
-    decision_scores = model.decision_function(X_lime_input_np)
-    prob_normal = 1 / (1 + np.exp(-decision_scores))
-    prob_anomaly = 1 - prob_normal
-    return np.vstack((prob_anomaly, prob_normal)).T
-
-
 if __name__ == '__main__':
-    if not app.debug:
-        file_handler = RotatingFileHandler('flask_app.log', maxBytes=1024 * 1024 * 100, backupCount=20)
-        file_handler.setLevel(logging.ERROR)
-        formatter = logging.Formatter("[%(asctime)s] {%(pathname)s:%(lineno)d} %(levelname)s - %(message)s")
-        file_handler.setFormatter(formatter)
-        app.logger.addHandler(file_handler)
-        # Quan trọng: đặt level cho logger của app để file_handler có tác dụng
-        app.logger.setLevel(logging.INFO) # Hoặc logging.ERROR tùy nhu cầu
-
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=True)
\ No newline at end of file
@@ -0,0 +1,205 @@
+# src/compiled_model.py
+# NumPy-only scoring objects produced by export_compiled_model.py.
+# They reproduce the fitted sklearn preprocessing and tree ensemble with
+# precomputed constants and flattened tree arrays, so single rows can be
+# scored without pandas or sklearn input validation. They are meant for
+# single rows and small batches; sklearn stays faster for thousands of rows.
+
+import json
+
+import numpy as np
+
+# Split missing-value handling, as in LightGBM
+MISSING_NONE, MISSING_ZERO, MISSING_NAN = 0, 1, 2
+K_ZERO_THRESHOLD = 1e-35
+
+
+class TreeEnsemble:
+    """
+    Trees flattened into parallel node arrays.
+
+    Leaves point to themselves (left == right == node), so every row can be
+    walked `max_depth` steps through all trees at once. `value` holds the
+    per-leaf output that is summed over trees.
+    """
+
+    def __init__(self, feature, threshold, left, right, value, roots, max_depth,
+                 default_left=None, missing_type=None, float32_inputs=False):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.max_depth = int(max_depth)
+        self.default_left = default_left
+        self.missing_type = missing_type
+        # sklearn trees compare float32-cast inputs against the thresholds
+        self.float32_inputs = bool(float32_inputs)
+        # LightGBM trees (which carry missing types) send NaN to 0.0 even at
+        # MISSING_NONE splits, so they always take the missing-value path
+        self.handles_missing = missing_type is not None
+
+    def apply(self, X):
+        """Returns the leaf index reached in every tree, shape (n_rows, n_trees)."""
+        if self.float32_inputs:
+            X = X.astype(np.float32).astype(np.float64)
+        rows = np.arange(X.shape[0])[:, None]
+        nodes = np.broadcast_to(self.roots, (X.shape[0], len(self.roots)))
+        for _ in range(self.max_depth):
+            x = X[rows, self.feature[nodes]]
+            if self.handles_missing:
+                missing_type = self.missing_type[nodes]
+                is_nan = np.isnan(x)
+                x = np.where(is_nan & (missing_type != MISSING_NAN), 0.0, x)
+                is_missing = (((missing_type == MISSING_ZERO) & (np.abs(x) <= K_ZERO_THRESHOLD))
+                              | ((missing_type == MISSING_NAN) & is_nan))
+                go_left = np.where(is_missing, self.default_left[nodes], x <= self.threshold[nodes])
+            else:
+                go_left = x <= self.threshold[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        return nodes
+
+    def sum_leaf_values(self, X):
+        # Trees are accumulated one after another, like the original models do
+        return np.cumsum(self.value[self.apply(X)], axis=1)[:, -1]
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix, max_depth, float32_inputs):
+        def get(name):
+            key = f'{prefix}{name}'
+            return arrays[key] if key in arrays else None
+        return cls(get('feature'), get('threshold'), get('left'), get('right'), get('value'), get('roots'),
+                   max_depth, default_left=get('default_left'), missing_type=get('missing_type'),
+                   float32_inputs=float32_inputs)
+
+
+class CompiledPipeline:
+    """
+    Compiled Sybil pipeline: imputers, scaler and cyclical encoding,
+    feature selection and a binary LightGBM classifier.
+
+    Input rows follow `input_columns`. Numeric groups are imputed and
+    standardised, cyclical groups are imputed and expanded into sin/cos
+    pairs, and `source_index` picks the selected model features out of
+    [numeric outputs, cyclical outputs].
+    """
+
+    kind = 'sybil_pipeline'
+
+    def __init__(self, input_columns, classes, arrays, max_depth, sigmoid=1.0):
+        self.input_columns = list(input_columns)
+        self.classes = np.asarray(classes)
+        self.arrays = arrays
+        self.max_depth = int(max_depth)
+        self.sigmoid = float(sigmoid)
+        self.affine_cols = arrays['affine_cols']
+        self.affine_fill = arrays['affine_fill']
+        self.affine_mean = arrays['affine_mean']
+        self.affine_scale = arrays['affine_scale']
+        self.cyclic_cols = arrays['cyclic_cols']
+        self.cyclic_fill = arrays['cyclic_fill']
+        self.cyclic_period = arrays['cyclic_period']
+        self.source_index = arrays['source_index']
+        self.trees = TreeEnsemble.from_arrays(arrays, 'tree_', max_depth, float32_inputs=False)
+
+    def rows_to_array(self, rows):
+        """Builds the input matrix from feature dicts (missing keys become NaN)."""
+        columns = self.input_columns
+        return np.array([[row.get(c, np.nan) for c in columns] for row in rows], dtype=np.float64)
+
+    def transform(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        numeric = X[:, self.affine_cols]
+        numeric = np.where(np.isnan(numeric), self.affine_fill, numeric)
+        numeric = (numeric - self.affine_mean) / self.affine_scale
+
+        cyclic = X[:, self.cyclic_cols]
+        cyclic = np.where(np.isnan(cyclic), self.cyclic_fill, cyclic)
+        angle = 2 * np.pi * cyclic
+        sin_cos = np.empty((X.shape[0], 2 * cyclic.shape[1]))
+        sin_cos[:, 0::2] = np.sin(angle / self.cyclic_period)
+        sin_cos[:, 1::2] = np.cos(angle / self.cyclic_period)
+
+        return np.concatenate([numeric, sin_cos], axis=1)[:, self.source_index]
+
+    def predict_proba(self, X):
+        raw = self.trees.sum_leaf_values(self.transform(X))
+        positive = 1.0 / (1.0 + np.exp(-self.sigmoid * raw))
+        return np.vstack((1.0 - positive, positive)).T
+
+    def predict(self, X):
+        return self.classes[np.argmax(self.predict_proba(X), axis=1)]
+
+    def score_row(self, row):
+        """Returns (predicted class, class probabilities) for one feature dict."""
+        proba = self.predict_proba(self.rows_to_array([row]))[0]
+        return self.classes[np.argmax(proba)], proba
+
+    def meta(self):
+        return {'kind': self.kind, 'input_columns': self.input_columns, 'classes': self.classes.tolist(),
+                'max_depth': self.max_depth, 'sigmoid': self.sigmoid}
+
+    @classmethod
+    def from_saved(cls, meta, arrays):
+        return cls(meta['input_columns'], meta['classes'], arrays, meta['max_depth'], meta['sigmoid'])
+
+
+class CompiledIsolationForest:
+    """
+    Compiled StandardScaler + IsolationForest.
+
+    `transform` applies the scaler and `decision_function` scores already
+    scaled rows, mirroring scaler.transform / model.decision_function.
+    Each leaf stores its path length (depth + average path length of the
+    samples left in it - 1), and tree features are mapped back to input
+    columns, so no per-tree feature subsetting is needed.
+    """
+
+    kind = 'isolation_forest'
+
+    def __init__(self, input_columns, arrays, max_depth, denominator, offset):
+        self.input_columns = list(input_columns)
+        self.arrays = arrays
+        self.max_depth = int(max_depth)
+        self.denominator = float(denominator)
+        self.offset = float(offset)
+        self.scaler_mean = arrays['scaler_mean']
+        self.scaler_scale = arrays['scaler_scale']
+        self.trees = TreeEnsemble.from_arrays(arrays, 'tree_', max_depth, float32_inputs=True)
+
+    def transform(self, X):
+        return (np.asarray(X, dtype=np.float64) - self.scaler_mean) / self.scaler_scale
+
+    def score_samples(self, X_scaled):
+        depths = self.trees.sum_leaf_values(np.asarray(X_scaled, dtype=np.float64))
+        if self.denominator == 0:
+            return -np.ones_like(depths)
+        return -(2 ** (-(depths / self.denominator)))
+
+    def decision_function(self, X_scaled):
+        return self.score_samples(X_scaled) - self.offset
+
+    def meta(self):
+        return {'kind': self.kind, 'input_columns': self.input_columns, 'max_depth': self.max_depth,
+                'denominator': self.denominator, 'offset': self.offset}
+
+    @classmethod
+    def from_saved(cls, meta, arrays):
+        return cls(meta['input_columns'], arrays, meta['max_depth'], meta['denominator'], meta['offset'])
+
+
+COMPILED_KINDS = {cls.kind: cls for cls in (CompiledPipeline, CompiledIsolationForest)}
+
+
+def save_compiled_model(compiled, path):
+    """Writes a compiled model to a .npz file (arrays plus JSON metadata)."""
+    np.savez(path, __meta__=np.array(json.dumps(compiled.meta())), **compiled.arrays)
+
+
+def load_compiled_model(path):
+    """Loads a compiled model saved by save_compiled_model; needs only NumPy."""
+    with np.load(path, allow_pickle=False) as data:
+        arrays = {name: data[name] for name in data.files if name != '__meta__'}
+        meta = json.loads(str(data['__meta__']))
+    return COMPILED_KINDS[meta['kind']].from_saved(meta, arrays)
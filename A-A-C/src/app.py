@@ -1,15 +1,26 @@
 # src/app.py
 
 from flask import Flask, request, jsonify
-import joblib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import threading
 import requests
+import time
+import sys
 import os
+import re
 
-# IMPORT CÁC HÀM TỪ FILE UTILS.PY
+_import_started = time.perf_counter()
+
+# Các module nhẹ; pandas, sklearn, utils... được import trong thread nền (xem load_service)
 try:
-    from src.utils import create_feature_dataframe, cyclical_encoder
+    from src.prediction_cache import PredictionCache
+    from src.prediction_logger import PredictionLogger
+    from src.wire_format import request_body, respond, unsupported_media_type
 except ImportError:
-    from utils import create_feature_dataframe, cyclical_encoder
+    from prediction_cache import PredictionCache
+    from prediction_logger import PredictionLogger
+    from wire_format import request_body, respond, unsupported_media_type
 
 app = Flask(__name__)
 
@@ -22,19 +33,218 @@ PIPELINE_PATHS = [
 ]
 
 pipeline = None
+compiled_pipeline = None  # NumPy-only scorer from export_compiled_model.py, preferred when present
+pd = None
+create_feature_profile = None
+watchlist = None
+counterparty_index = None
+startup_error = None
+
+# Trạng thái khởi động: /health trả lời ngay, /ready chỉ OK khi model đã được tải
+model_ready = threading.Event()
+STARTUP_TIMINGS = {}
+
+
+@contextmanager
+def startup_phase(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STARTUP_TIMINGS[name] = round(time.perf_counter() - started, 4)
+
+
+def load_service():
+    """Imports the heavy libraries, loads the pipeline and starts the watchlist."""
+    global pipeline, compiled_pipeline, pd, create_feature_profile, watchlist, counterparty_index, startup_error
 
-# Dùng try-except để xử lý việc tải mô hình một cách an toàn
-for path in PIPELINE_PATHS:
     try:
-        pipeline = joblib.load(path)
-        print(f"✅ AI Model loaded successfully from: {path}")
-        break
+        with startup_phase('import_libraries'):
+            import joblib
+            try:
+                from src.utils import create_feature_profile, cyclical_encoder
+                from src.watchlist import WatchlistScheduler, WatchlistFile
+                from src.compiled_model import load_compiled_model
+                from src.counterparty_index import CounterpartyIndex
+            except ImportError:
+                from utils import create_feature_profile, cyclical_encoder
+                from watchlist import WatchlistScheduler, WatchlistFile
+                from compiled_model import load_compiled_model
+                from counterparty_index import CounterpartyIndex
+            # Pipeline được pickle từ notebook nên tham chiếu tới __main__.cyclical_encoder
+            if not hasattr(sys.modules['__main__'], 'cyclical_encoder'):
+                sys.modules['__main__'].cyclical_encoder = cyclical_encoder
+
+        # Dùng try-except để xử lý việc tải mô hình một cách an toàn
+        with startup_phase('load_model'):
+            for path in PIPELINE_PATHS:
+                compiled_path = os.path.splitext(path)[0] + '.compiled.npz'
+                if USE_COMPILED_MODEL and os.path.exists(compiled_path):
+                    try:
+                        compiled_pipeline = load_compiled_model(compiled_path)
+                        print(f"✅ Compiled AI Model loaded successfully from: {compiled_path}")
+                        break
+                    except Exception as e:
+                        print(f"❌ Failed to load from {compiled_path}: {e}")
+                if not os.path.exists(path):
+                    continue
+                try:
+                    # pandas chỉ cần cho pipeline sklearn; bản compiled chạy thuần NumPy
+                    import pandas as pd
+                    pipeline = joblib.load(path)
+                    print(f"✅ AI Model loaded successfully from: {path}")
+                    break
+                except Exception as e:
+                    print(f"❌ Failed to load from {path}: {e}")
+
+        if not model_loaded():
+            startup_error = 'Could not load model from any path'
+            print("❌ ERROR: Could not load model from any path")
+
+        # Chỉ mục counterparty -> ví, dùng để phát hiện cụm ví Sybil
+        with startup_phase('load_counterparty_index'):
+            if COUNTERPARTY_INDEX_PATH and os.path.exists(COUNTERPARTY_INDEX_PATH):
+                counterparty_index = CounterpartyIndex.load(COUNTERPARTY_INDEX_PATH, max_hub_degree=MAX_HUB_DEGREE)
+            else:
+                counterparty_index = CounterpartyIndex(max_hub_degree=MAX_HUB_DEGREE)
+            # Nén, dựng lại cụm và lưu file chạy ở thread nền, không chặn request
+            counterparty_index.start(COUNTERPARTY_INDEX_PATH or None,
+                                     int(os.environ.get('COUNTERPARTY_INDEX_SAVE_SECONDS', 300)))
+
+        # Mỗi worker gunicorn có scheduler và cache riêng; danh sách ví dùng chung qua WATCHLIST_FILE
+        with startup_phase('start_watchlist'):
+            watchlist_file = WatchlistFile(WATCHLIST_FILE) if WATCHLIST_FILE else None
+            if watchlist_file is not None:
+                watchlist_file.update(add=WATCHLIST_ADDRESSES, only_if_missing=True)
+            watchlist = WatchlistScheduler(
+                score_watched_wallet,
+                prediction_cache,
+                refresh_seconds=int(os.environ.get('WATCHLIST_REFRESH_SECONDS', 300)),
+                max_concurrency=int(os.environ.get('WATCHLIST_MAX_CONCURRENCY', 4)),
+                counterparty_index=counterparty_index,
+                watchlist_file=watchlist_file,
+            )
+            if watchlist_file is None:
+                watchlist.add(WATCHLIST_ADDRESSES)
+            if model_loaded() and (watchlist_file is not None or WATCHLIST_ADDRESSES):
+                watchlist.start()
     except Exception as e:
-        print(f"❌ Failed to load from {path}: {e}")
-        continue
+        startup_error = str(e)
+        print(f"❌ ERROR: AI service failed to start: {e}")
+    finally:
+        STARTUP_TIMINGS['total'] = round(time.perf_counter() - _import_started, 4)
+        print(f"Startup timings (s): {STARTUP_TIMINGS}")
+        model_ready.set()
+
+
+def model_loaded():
+    return pipeline is not None or compiled_pipeline is not None
+
+
+def service_unavailable():
+    """Error response for requests that need the model, or None when it is usable."""
+    if not model_ready.is_set():
+        return jsonify({'error': 'Model is still loading'}), 503
+    if not model_loaded() or watchlist is None:
+        return jsonify({'error': 'Model is not available'}), 500
+    return None
+
+
+def score_profile(wallet_address, profile):
+    """Scores one feature profile (dict) and builds the API result."""
+    if compiled_pipeline is not None:
+        prediction, prediction_proba = compiled_pipeline.score_row(profile)
+    else:
+        features_df = pd.DataFrame([profile])
+        prediction = pipeline.predict(features_df)[0]
+        prediction_proba = pipeline.predict_proba(features_df)[0]
+
+    return {
+        'wallet_address': wallet_address,
+        'prediction': 'Sybil' if prediction == 1 else 'Normal',
+        'is_sybil': int(prediction),
+        'confidence': float(prediction_proba[prediction]),
+        'sybil_probability': float(prediction_proba[1])
+    }
+
+
+# Ghi log dự đoán theo định dạng feature-row, không chặn request (để trống để tắt)
+PREDICTION_LOG_DIR = os.environ.get('PREDICTION_LOG_DIR', 'data/raw/prediction_logs')
+prediction_logger = PredictionLogger(PREDICTION_LOG_DIR) if PREDICTION_LOG_DIR else None
+if prediction_logger is not None:
+    prediction_logger.start()
+
+
+def log_prediction(result, profile, source):
+    if prediction_logger is None:
+        return
+    prediction_logger.log({
+        'wallet_address': result['wallet_address'],
+        'label': result['is_sybil'],
+        **profile,
+        'sybil_probability': result['sybil_probability'],
+        'source': source
+    })
+
+
+def add_cluster_features(result):
+    """Adds the wallet's counterparty-cluster features to a prediction result."""
+    result['cluster_features'] = counterparty_index.cluster_features(result['wallet_address'])
+    return result
+
+
+def score_watched_wallet(wallet_address, profile):
+    result = add_cluster_features(score_profile(wallet_address, profile))
+    log_prediction(result, {**profile, **result['cluster_features']}, 'watchlist')
+    return result
+
+
+# Kết quả dự đoán được tính sẵn cho các ví trong watchlist
+prediction_cache = PredictionCache(ttl_seconds=int(os.environ.get('PREDICTION_CACHE_TTL', 900)))
+USE_COMPILED_MODEL = os.environ.get('USE_COMPILED_MODEL', '1') != '0'
+COUNTERPARTY_INDEX_PATH = os.environ.get('COUNTERPARTY_INDEX_PATH', '')
+MAX_HUB_DEGREE = int(os.environ.get('COUNTERPARTY_MAX_HUB_DEGREE', 50))
+BATCH_MAX_WALLETS = int(os.environ.get('BATCH_MAX_WALLETS', 50))
+WATCHLIST_ADDRESSES = [a.strip() for a in os.environ.get('WATCHLIST_ADDRESSES', '').split(',') if a.strip()]
+# File danh sách ví dùng chung cho mọi worker, ví dụ data/watchlist.txt
+# (để trống: watchlist chỉ đọc, lấy từ WATCHLIST_ADDRESSES)
+WATCHLIST_FILE = os.environ.get('WATCHLIST_FILE', '')
+# Mỗi worker tự crawl mọi ví trong watchlist và giữ giao dịch của chúng trong bộ nhớ
+WATCHLIST_MAX_SIZE = int(os.environ.get('WATCHLIST_MAX_SIZE', 500))
+APTOS_ADDRESS_PATTERN = re.compile(r'0x[0-9a-fA-F]{1,64}')
+WATCHLIST_SCOPE_NOTE = ('Each worker process runs its own scheduler and prediction cache; '
+                        'changes reach every worker through the watchlist file within a scheduler tick.')
+
+threading.Thread(target=load_service, name='model-loader', daemon=True).start()
 
-if pipeline is None:
-    print("❌ ERROR: Could not load model from any path")
+# Các ví trong một batch được lấy dữ liệu song song, mỗi thread một Session
+batch_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('BATCH_MAX_WORKERS', 8)),
+                                    thread_name_prefix='batch')
+_batch_sessions = threading.local()
+
+
+def predict_wallet(session, wallet_address):
+    """Prediction result of one wallet, from the cache or freshly profiled and scored."""
+    cached = prediction_cache.get(wallet_address)
+    if cached is not None:
+        return cached
+
+    # Dùng hàm đã import
+    profile = create_feature_profile(session, wallet_address, counterparty_index)
+
+    result = add_cluster_features(score_profile(wallet_address, profile))
+    log_prediction(result, {**profile, **result['cluster_features']}, 'request')
+    return result
+
+
+def predict_batch_wallet(wallet_address):
+    session = getattr(_batch_sessions, 'session', None)
+    if session is None:
+        session = _batch_sessions.session = requests.Session()
+    try:
+        return predict_wallet(session, wallet_address)
+    except Exception as e:
+        return {'wallet_address': wallet_address, 'error': f'An error occurred during prediction: {str(e)}'}
 
 
 @app.route('/', methods=['GET'])
@@ -43,10 +253,14 @@ def home():
         'message': 'SafeSwap AI Service',
         'status': 'running',
         'version': '1.0.0',
-        'model_loaded': pipeline is not None,
+        'model_loaded': model_loaded(),
         'endpoints': {
             'health': '/health',
-            'predict': '/predict (POST)'
+            'ready': '/ready',
+            'predict': '/predict (POST)',
+            'predict_batch': '/predict/batch (POST)',
+            'watchlist': '/watchlist (GET, POST, DELETE)',
+            'clusters': '/clusters/<wallet_address> (GET)'
         }
     })
 
@@ -56,42 +270,108 @@ def health():
     return jsonify({
         'status': 'OK',
         'service': 'SafeSwap AI Service',
-        'model_loaded': pipeline is not None,
-        'version': '1.0.0'
+        'model_loaded': model_loaded(),
+        'version': '1.0.0',
+        'prediction_log': prediction_logger.status() if prediction_logger is not None else None
     })
 
 
+@app.route('/ready', methods=['GET'])
+def ready():
+    is_ready = model_ready.is_set() and model_loaded()
+    return jsonify({
+        'ready': is_ready,
+        'loading': not model_ready.is_set(),
+        'error': startup_error,
+        'startup_timings': STARTUP_TIMINGS
+    }), 200 if is_ready else 503
+
+
 @app.route('/predict', methods=['POST'])
 def predict():
-    if pipeline is None:
-        return jsonify({'error': 'Model is not available'}), 500
-
-    data = request.get_json()
-    if not data or 'wallet_address' not in data:
-        return jsonify({'error': 'Missing wallet_address in request body'}), 400
+    unavailable = service_unavailable() or unsupported_media_type()
+    if unavailable is not None:
+        return unavailable
 
-    wallet_address = data['wallet_address']
+    data = request_body()
+    if not isinstance(data, dict) or 'wallet_address' not in data:
+        return respond({'error': 'Missing wallet_address in request body'}, 400)
 
     try:
-        session = requests.Session()
-        # Dùng hàm đã import
-        features_df = create_feature_dataframe(session, wallet_address)
-
-        prediction = pipeline.predict(features_df)
-        prediction_proba = pipeline.predict_proba(features_df)
-
-        result = {
-            'wallet_address': wallet_address,
-            'prediction': 'Sybil' if prediction[0] == 1 else 'Normal',
-            'is_sybil': int(prediction[0]),
-            'confidence': float(prediction_proba[0][prediction[0]]),
-            'sybil_probability': float(prediction_proba[0][1])
-        }
-
-        return jsonify(result)
+        return respond(predict_wallet(requests.Session(), data['wallet_address']))
 
     except Exception as e:
-        return jsonify({'error': f'An error occurred during prediction: {str(e)}'}), 500
+        return respond({'error': f'An error occurred during prediction: {str(e)}'}, 500)
+
+
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch():
+    unavailable = service_unavailable() or unsupported_media_type()
+    if unavailable is not None:
+        return unavailable
+
+    data = request_body()
+    addresses = data.get('wallet_addresses') if isinstance(data, dict) else None
+    if not isinstance(addresses, list) or not all(isinstance(a, str) for a in addresses):
+        return respond({'error': 'Missing wallet_addresses list in request body'}, 400)
+    if len(addresses) > BATCH_MAX_WALLETS:
+        return respond({'error': f'Too many wallets in one batch (max {BATCH_MAX_WALLETS})'}, 413)
+
+    # Mỗi ví lỗi được trả về riêng với trường 'error', không làm hỏng cả batch
+    results = list(batch_executor.map(predict_batch_wallet, addresses))
+    return respond({'results': results, 'count': len(results)})
+
+
+@app.route('/watchlist', methods=['GET', 'POST', 'DELETE'])
+def manage_watchlist():
+    unavailable = service_unavailable()
+    if unavailable is not None:
+        return unavailable
+
+    if request.method == 'GET':
+        return jsonify({**watchlist.status(), 'note': WATCHLIST_SCOPE_NOTE})
+
+    if watchlist.watchlist_file is None:
+        return jsonify({'error': 'Watchlist is read-only (set WATCHLIST_FILE to manage it over HTTP)'}), 405
+
+    data = request.get_json(silent=True)
+    addresses = data.get('addresses') if isinstance(data, dict) else None
+    if not isinstance(addresses, list) or not all(isinstance(a, str) for a in addresses):
+        return jsonify({'error': 'Missing addresses list in request body'}), 400
+    invalid = [a for a in addresses if not APTOS_ADDRESS_PATTERN.fullmatch(a)]
+    if invalid:
+        return jsonify({'error': 'Invalid Aptos addresses', 'invalid_addresses': invalid[:10]}), 400
+
+    # Ghi vào file dùng chung; worker này áp dụng ngay, các worker khác ở lần tick tiếp theo
+    if request.method == 'POST':
+        try:
+            watchlist.watchlist_file.update(add=addresses, max_size=WATCHLIST_MAX_SIZE)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 413
+    else:
+        watchlist.watchlist_file.update(remove=addresses)
+    watchlist.sync()
+    watchlist.start()
+    return jsonify({**watchlist.status(), 'note': WATCHLIST_SCOPE_NOTE})
+
+
+@app.route('/clusters/<wallet_address>', methods=['GET'])
+def clusters(wallet_address):
+    unavailable = service_unavailable()
+    if unavailable is not None:
+        return unavailable
+
+    min_shared = request.args.get('min_shared', 1, type=int)
+    limit = request.args.get('limit', 100, type=int)
+    sharing = counterparty_index.wallets_sharing(wallet_address, min_shared=min_shared, limit=limit)
+    return jsonify({
+        'wallet_address': wallet_address,
+        'cluster_features': counterparty_index.cluster_features(wallet_address),
+        'wallets_sharing_counterparties': [
+            {'wallet_address': address, 'shared_counterparties': shared} for address, shared in sharing
+        ],
+        'index': counterparty_index.status()
+    })
 
 
 if __name__ == '__main__':
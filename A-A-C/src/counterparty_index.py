@@ -0,0 +1,455 @@
+# src/counterparty_index.py
+# Cross-wallet index of counterparties (interacted addresses and contracts),
+# fed by every profiled wallet, used to spot groups of wallets (Sybil farms)
+# that share funders and counterparties.
+
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock
+    fcntl = None
+
+import numpy as np
+
+
+class _Interner:
+    """Maps strings to dense int ids; the strings themselves are only kept once."""
+
+    def __init__(self, strings=()):
+        self.strings = list(strings)
+        self.ids = {s: i for i, s in enumerate(self.strings)}
+
+    def __len__(self):
+        return len(self.strings)
+
+    def intern(self, value):
+        idx = self.ids.get(value)
+        if idx is None:
+            idx = len(self.strings)
+            self.ids[value] = idx
+            self.strings.append(value)
+        return idx
+
+    def lookup(self, value):
+        return self.ids.get(value, -1)
+
+
+def _grow(array, size, fill=0):
+    """Returns `array` with room for at least `size` items (capacity doubles)."""
+    if size <= len(array):
+        return array
+    grown = np.full(max(size, 2 * len(array), 1024), fill, dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+def _edge_keys(wallets, cps):
+    """(wallet, counterparty) pairs as single int64 keys."""
+    return (np.asarray(wallets, dtype=np.int64) << 32) | np.asarray(cps, dtype=np.int64)
+
+
+class CounterpartyIndex:
+    """
+    Inverted index counterparty -> wallets with union-find clustering.
+
+    Unique (wallet, counterparty) edges live in two append-only int32
+    arrays. Queries use CSR views (wallet -> counterparties and
+    counterparty -> wallets) built from the compacted prefix of the edges,
+    plus a scan of the few edges added since; the views are rebuilt once
+    the uncompacted tail grows past `compact_every` edges or 10% of the index.
+
+    Wallets are unioned when they share a counterparty, except "hubs":
+    counterparties with more than `max_hub_degree` wallets (0x1 framework,
+    popular DEX routers, ...) link no wallets and are ignored by the sharing
+    queries. Union-find cannot undo a union, so when a counterparty becomes
+    a hub the clusters are rebuilt from the edges.
+
+    The index file is shared by all worker processes: `save` merges the
+    edges other workers saved before writing, under a lock on `<path>.lock`.
+
+    Once `start()` has been called, compaction, cluster rebuilds and saving
+    run on a background thread: the heavy work is done on a snapshot of the
+    append-only edges without holding the lock, and only the results are
+    swapped in under it, so request threads calling `add_wallet` and the
+    queries are never stalled by it. Without `start()` they run inline.
+    """
+
+    def __init__(self, max_hub_degree=50, compact_every=100000):
+        self.max_hub_degree = max_hub_degree
+        self.compact_every = compact_every
+        self.wallets = _Interner()
+        self.counterparties = _Interner()
+        self._lock = threading.RLock()
+        self.n_edges = 0
+        self._edge_wallet = np.empty(0, dtype=np.int32)
+        self._edge_cp = np.empty(0, dtype=np.int32)
+        self._cp_degree = np.empty(0, dtype=np.int32)
+        self._cp_first_wallet = np.empty(0, dtype=np.int32)  # wallet a non-hub counterparty links new wallets to
+        self._parent = np.empty(0, dtype=np.int32)
+        self._cluster_size = np.empty(0, dtype=np.int32)
+        # Changes the union-find cannot express (a counterparty became a hub
+        # after linking wallets, merged edges); clusters are rebuilt when the
+        # two counters differ
+        self._cluster_changes = 0
+        self._clusters_built = 0
+        self._file_version = None  # version of the index file last merged or written
+        self._maintenance_due = threading.Event()
+        self._background = False
+        self._n_compacted = 0
+        self._wallet_indptr = np.zeros(1, dtype=np.int64)
+        self._wallet_cps = np.empty(0, dtype=np.int32)
+        self._cp_indptr = np.zeros(1, dtype=np.int64)
+        self._cp_wallets = np.empty(0, dtype=np.int32)
+        self.dirty = False
+
+    def __len__(self):
+        return len(self.wallets)
+
+    # --- Updates ---
+
+    def add_wallet(self, address, counterparties):
+        """Adds (or extends) a wallet with its counterparty addresses."""
+        with self._lock:
+            wallet = self._add_wallet_id(address)
+            cp_ids = np.unique(np.array([self._add_counterparty_id(c) for c in counterparties if c != address],
+                                        dtype=np.int32))
+            new = np.setdiff1d(cp_ids, self._counterparties_of(wallet), assume_unique=True)
+            if len(new) == 0:
+                return
+            self._append_edges(np.full(len(new), wallet, dtype=np.int32), new)
+
+            for cp in new.tolist():
+                first = self._cp_first_wallet[cp]
+                degree = self._cp_degree[cp]
+                if first < 0:
+                    self._cp_first_wallet[cp] = wallet
+                elif degree <= self.max_hub_degree:
+                    self._union(first, wallet)
+                elif degree == self.max_hub_degree + 1 and degree > 2:
+                    self._cluster_changes += 1  # its unions so far must be undone
+                    self._request_maintenance()
+
+            self.dirty = True
+            if self._compaction_due():
+                self._request_maintenance()
+
+    def _append_edges(self, wallets, cps):
+        """Appends new, unique (wallet, counterparty) edges and counts them in the degrees."""
+        end = self.n_edges + len(wallets)
+        self._edge_wallet = _grow(self._edge_wallet, end)
+        self._edge_cp = _grow(self._edge_cp, end)
+        self._edge_wallet[self.n_edges:end] = wallets
+        self._edge_cp[self.n_edges:end] = cps
+        self.n_edges = end
+        np.add.at(self._cp_degree, cps, 1)
+
+    def _compaction_due(self):
+        pending = self.n_edges - self._n_compacted
+        return pending >= self.compact_every or (pending > 1000 and pending * 10 >= self._n_compacted)
+
+    def _clusters_stale(self):
+        return self._cluster_changes != self._clusters_built
+
+    def _request_maintenance(self):
+        """Wakes the background thread; without one, compacts inline (clusters are rebuilt on query)."""
+        if self._background:
+            self._maintenance_due.set()
+        elif self._compaction_due():
+            self._compact()
+
+    def _maintain(self):
+        if self._compaction_due():
+            self._compact()
+        if self._clusters_stale():
+            self._rebuild_clusters()
+
+    def _add_wallet_id(self, address):
+        wallet = self.wallets.intern(address)
+        if wallet >= len(self._parent) or self._parent[wallet] < 0:
+            self._parent = _grow(self._parent, wallet + 1, fill=-1)
+            self._cluster_size = _grow(self._cluster_size, wallet + 1)
+            self._parent[wallet] = wallet
+            self._cluster_size[wallet] = 1
+        return wallet
+
+    def _add_counterparty_id(self, address):
+        cp = self.counterparties.intern(address)
+        if cp >= len(self._cp_degree):
+            self._cp_degree = _grow(self._cp_degree, cp + 1)
+            self._cp_first_wallet = _grow(self._cp_first_wallet, cp + 1, fill=-1)
+        return cp
+
+    # --- Union-find ---
+
+    def _find(self, wallet):
+        parent = self._parent
+        root = wallet
+        while parent[root] != root:
+            root = parent[root]
+        while parent[wallet] != root:  # path compression
+            parent[wallet], wallet = root, parent[wallet]
+        return root
+
+    def _union(self, a, b):
+        a, b = self._find(a), self._find(b)
+        if a == b:
+            return
+        if self._cluster_size[a] < self._cluster_size[b]:
+            a, b = b, a
+        self._parent[b] = a
+        self._cluster_size[a] += self._cluster_size[b]
+
+    def _rebuild_clusters(self):
+        """
+        Recomputes the union-find from the edges, linking wallets through
+        non-hub counterparties only. The components are computed on a
+        snapshot of the edges outside the lock; edges added meanwhile are
+        replayed when the result is swapped in.
+        """
+        with self._lock:
+            changes = self._cluster_changes
+            n_edges, n_wallets, n_cps = self.n_edges, len(self.wallets), len(self.counterparties)
+            wallets, cps = self._edge_wallet[:n_edges], self._edge_cp[:n_edges]  # append-only: safe to read later
+            degree = self._cp_degree[:n_cps].copy()
+
+        # First wallet of every counterparty, in edge order
+        first_edge = np.full(n_cps, n_edges, dtype=np.int64)
+        np.minimum.at(first_edge, cps, np.arange(n_edges))
+        seen = first_edge < n_edges
+
+        # Connected components: every wallet takes the smallest label among the
+        # wallets sharing a non-hub counterparty with it, then labels are
+        # shortcut (label of label) until nothing changes
+        linked = degree[cps] <= self.max_hub_degree
+        linked_wallets, linked_cps = wallets[linked], cps[linked]
+        labels = np.arange(n_wallets, dtype=np.int32)
+        cp_min = np.empty(n_cps, dtype=np.int32)
+        while True:
+            cp_min.fill(n_wallets)
+            np.minimum.at(cp_min, linked_cps, labels[linked_wallets])
+            updated = labels.copy()
+            np.minimum.at(updated, linked_wallets, cp_min[linked_cps])
+            while True:
+                jumped = updated[updated]
+                if np.array_equal(jumped, updated):
+                    break
+                updated = jumped
+            if np.array_equal(updated, labels):
+                break
+            labels = updated
+        sizes = np.bincount(labels, minlength=n_wallets)
+
+        with self._lock:
+            self._parent[:n_wallets] = labels  # every label is its component's root
+            self._cluster_size[:n_wallets] = sizes
+            self._cp_first_wallet[:n_cps][seen] = wallets[first_edge[seen]]
+            self._parent[n_wallets:len(self.wallets)] = np.arange(n_wallets, len(self.wallets), dtype=np.int32)
+            self._cluster_size[n_wallets:len(self.wallets)] = 1
+            for wallet, cp in zip(self._edge_wallet[n_edges:self.n_edges].tolist(),
+                                  self._edge_cp[n_edges:self.n_edges].tolist()):
+                first = self._cp_first_wallet[cp]
+                if first < 0:
+                    self._cp_first_wallet[cp] = wallet
+                elif first != wallet and self._cp_degree[cp] <= self.max_hub_degree:
+                    self._union(first, wallet)
+            # A counterparty that became a hub meanwhile leaves the clusters stale
+            self._clusters_built = changes
+
+    def _cluster_root(self, wallet):
+        if self._clusters_stale() and not self._background:
+            self._rebuild_clusters()
+        return self._find(wallet)
+
+    # --- CSR views ---
+
+    def _compact(self):
+        """Builds the CSR views of a snapshot of the edges outside the lock, then swaps them in."""
+        with self._lock:
+            n, n_wallets, n_cps = self.n_edges, len(self.wallets), len(self.counterparties)
+            if n == self._n_compacted:
+                return
+            wallets, cps = self._edge_wallet[:n], self._edge_cp[:n]  # append-only: safe to read later
+        order = np.argsort(wallets, kind='stable')
+        wallet_cps = cps[order]
+        wallet_indptr = np.concatenate([[0], np.cumsum(np.bincount(wallets, minlength=n_wallets))])
+        order = np.argsort(cps, kind='stable')
+        cp_wallets = wallets[order]
+        cp_indptr = np.concatenate([[0], np.cumsum(np.bincount(cps, minlength=n_cps))])
+        with self._lock:
+            if n > self._n_compacted:
+                self._wallet_cps, self._wallet_indptr = wallet_cps, wallet_indptr
+                self._cp_wallets, self._cp_indptr = cp_wallets, cp_indptr
+                self._n_compacted = n
+
+    def _counterparties_of(self, wallet):
+        compacted = np.empty(0, dtype=np.int32)
+        if wallet + 1 < len(self._wallet_indptr):
+            compacted = self._wallet_cps[self._wallet_indptr[wallet]:self._wallet_indptr[wallet + 1]]
+        tail = slice(self._n_compacted, self.n_edges)
+        recent = self._edge_cp[tail][self._edge_wallet[tail] == wallet]
+        return np.union1d(compacted, recent)
+
+    def _wallets_of(self, cp_ids):
+        parts = [self._cp_wallets[self._cp_indptr[cp]:self._cp_indptr[cp + 1]]
+                 for cp in cp_ids.tolist() if cp + 1 < len(self._cp_indptr)]
+        tail = slice(self._n_compacted, self.n_edges)
+        parts.append(self._edge_wallet[tail][np.isin(self._edge_cp[tail], cp_ids)])
+        return np.concatenate(parts)
+
+    # --- Queries ---
+
+    def shared_counts(self, address):
+        """Wallet ids sharing at least one non-hub counterparty with `address`, and how many each."""
+        with self._lock:
+            wallet = self.wallets.lookup(address)
+            if wallet < 0:
+                return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int64)
+            cp_ids = self._counterparties_of(wallet)
+            cp_ids = cp_ids[self._cp_degree[cp_ids] <= self.max_hub_degree]
+            neighbours = self._wallets_of(cp_ids)
+        neighbours = neighbours[neighbours != wallet]
+        return np.unique(neighbours, return_counts=True)
+
+    def wallets_sharing(self, address, min_shared=1, limit=100):
+        """Wallets sharing >= `min_shared` non-hub counterparties with `address`, most shared first."""
+        ids, counts = self.shared_counts(address)
+        keep = counts >= min_shared
+        ids, counts = ids[keep], counts[keep]
+        order = np.argsort(-counts, kind='stable')[:limit]
+        return [(self.wallets.strings[i], int(c)) for i, c in zip(ids[order].tolist(), counts[order].tolist())]
+
+    def cluster_features(self, address):
+        """Cluster-level features of a wallet (zeros for an unknown wallet)."""
+        ids, counts = self.shared_counts(address)
+        with self._lock:
+            wallet = self.wallets.lookup(address)
+            cluster_size = int(self._cluster_size[self._cluster_root(wallet)]) if wallet >= 0 else 0
+            n_counterparties = len(self._counterparties_of(wallet)) if wallet >= 0 else 0
+        return {
+            'cluster_size': cluster_size,
+            'counterparty_count': n_counterparties,
+            'wallets_sharing_counterparties': int(len(ids)),
+            'max_shared_counterparties': int(counts.max()) if len(counts) else 0,
+        }
+
+    def status(self):
+        return {'wallets': len(self.wallets), 'counterparties': len(self.counterparties), 'edges': self.n_edges}
+
+    # --- Persistence ---
+
+    def merge(self, path):
+        """Adds the edges saved in an index file (by this or another process) to the index."""
+        with np.load(path, allow_pickle=False) as data:
+            wallet_names = data['wallets'].tolist()
+            cp_names = data['counterparties'].tolist()
+            edge_wallet, edge_cp = data['edge_wallet'], data['edge_cp']
+        # Known strings are looked up without the lock; only new ones are interned under it
+        wallet_ids = np.array([self.wallets.lookup(w) for w in wallet_names], dtype=np.int64)
+        cp_ids = np.array([self.counterparties.lookup(c) for c in cp_names], dtype=np.int64)
+        with self._lock:
+            for i in np.flatnonzero(wallet_ids < 0).tolist():
+                wallet_ids[i] = self._add_wallet_id(wallet_names[i])
+            for i in np.flatnonzero(cp_ids < 0).tolist():
+                cp_ids[i] = self._add_counterparty_id(cp_names[i])
+            n = self.n_edges
+            known_wallets, known_cps = self._edge_wallet[:n], self._edge_cp[:n]  # append-only: safe to read later
+        if len(edge_wallet) == 0:
+            return
+
+        keys = np.unique(_edge_keys(wallet_ids[edge_wallet], cp_ids[edge_cp]))
+        keys = np.setdiff1d(keys, _edge_keys(known_wallets, known_cps), assume_unique=True)
+        if len(keys) == 0:
+            return
+        with self._lock:
+            # Edges added since the snapshot above
+            keys = np.setdiff1d(keys, _edge_keys(self._edge_wallet[n:self.n_edges], self._edge_cp[n:self.n_edges]),
+                                assume_unique=True)
+            if len(keys) == 0:
+                return
+            self._append_edges((keys >> 32).astype(np.int32), (keys & 0xFFFFFFFF).astype(np.int32))
+            self._cluster_changes += 1
+            self._request_maintenance()
+
+    def _read_file_version(self, path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def save(self, path):
+        """
+        Merges the edges saved to `path` by other workers since this index last
+        read or wrote it, then writes the combined index there (atomically
+        replaced). Serialization works on a snapshot, outside the lock.
+        """
+        with open(f'{path}.lock', 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            version = self._read_file_version(path)
+            if version is not None and version != self._file_version:
+                self.merge(path)
+            with self._lock:
+                n, n_wallets, n_cps = self.n_edges, len(self.wallets), len(self.counterparties)
+                wallet_names = self.wallets.strings[:n_wallets]
+                cp_names = self.counterparties.strings[:n_cps]
+                edge_wallet, edge_cp = self._edge_wallet[:n], self._edge_cp[:n]  # append-only: safe to read later
+                self.dirty = False  # edges added from now on mark it dirty again
+            tmp_path = f'{path}.{os.getpid()}.tmp.npz'
+            try:
+                np.savez(tmp_path,
+                         wallets=np.array(wallet_names, dtype=np.str_),
+                         counterparties=np.array(cp_names, dtype=np.str_),
+                         edge_wallet=edge_wallet, edge_cp=edge_cp)
+                os.replace(tmp_path, path)
+            except OSError:
+                self.dirty = True
+                raise
+            self._file_version = self._read_file_version(path)
+
+    def sync(self, path):
+        """Saves new edges to `path`, or picks up the ones other workers saved since the last sync."""
+        if self.dirty:
+            self.save(path)
+            return
+        version = self._read_file_version(path)
+        if version is not None and version != self._file_version:
+            self.merge(path)
+            self._file_version = version
+
+    def start(self, path=None, save_interval_seconds=300):
+        """
+        Starts the background thread that compacts the index and rebuilds the
+        clusters when needed and, when `path` is given, syncs the index with
+        that file every `save_interval_seconds`.
+        """
+        with self._lock:
+            if self._background:
+                return
+            self._background = True
+        threading.Thread(target=self._run, args=(path, save_interval_seconds),
+                         name='counterparty-index', daemon=True).start()
+
+    def _run(self, path, save_interval_seconds):
+        next_sync = time.monotonic() + save_interval_seconds
+        while True:
+            self._maintenance_due.wait(timeout=max(0.0, next_sync - time.monotonic()))
+            self._maintenance_due.clear()
+            try:
+                self._maintain()
+                if path and time.monotonic() >= next_sync:
+                    next_sync = time.monotonic() + save_interval_seconds
+                    self.sync(path)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Warning: Could not sync counterparty index with {path}: {e}")
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        index = cls(**kwargs)
+        index.merge(path)
+        index._file_version = index._read_file_version(path)
+        index._compact()
+        return index
@@ -0,0 +1,310 @@
+# src/export_compiled_model.py
+# Compiles fitted sklearn artifacts into the NumPy-only scoring objects of
+# compiled_model.py and saves them next to the originals.
+#
+# Usage (from A-A-C/):
+#   python -m src.export_compiled_model sybil models/aptos_pro_pipeline.joblib
+#   python -m src.export_compiled_model isolation-forest <model.joblib> <scaler.pkl>
+
+import os
+import sys
+
+import joblib
+import numpy as np
+from sklearn.ensemble import IsolationForest
+from sklearn.ensemble._iforest import _average_path_length
+from sklearn.feature_selection import SelectFromModel
+from sklearn.impute import SimpleImputer
+from sklearn.preprocessing import FunctionTransformer, StandardScaler
+
+try:
+    from src.compiled_model import (CompiledPipeline, CompiledIsolationForest, MISSING_NONE, MISSING_ZERO,
+                                    MISSING_NAN, save_compiled_model, load_compiled_model)
+    from src.utils import CYCLICAL_MAX_VALUES, cyclical_encoder
+except ImportError:
+    from compiled_model import (CompiledPipeline, CompiledIsolationForest, MISSING_NONE, MISSING_ZERO,
+                                MISSING_NAN, save_compiled_model, load_compiled_model)
+    from utils import CYCLICAL_MAX_VALUES, cyclical_encoder
+
+LGBM_MISSING_TYPES = {'None': MISSING_NONE, 'Zero': MISSING_ZERO, 'NaN': MISSING_NAN}
+
+
+# ==============================================================================
+# SECTION 1: TREE FLATTENING
+# ==============================================================================
+
+class _TreeBuilder:
+    """Accumulates nodes of several trees into flat arrays."""
+
+    def __init__(self):
+        self.feature, self.threshold, self.left, self.right, self.value = [], [], [], [], []
+        self.default_left, self.missing_type = [], []
+        self.roots = []
+        self.max_depth = 0
+
+    def add_node(self, feature=0, threshold=np.inf, value=0.0, default_left=False, missing_type=MISSING_NONE):
+        index = len(self.feature)
+        self.feature.append(feature)
+        self.threshold.append(threshold)
+        self.left.append(index)  # leaves point to themselves
+        self.right.append(index)
+        self.value.append(value)
+        self.default_left.append(default_left)
+        self.missing_type.append(missing_type)
+        return index
+
+    def arrays(self, with_missing):
+        arrays = {
+            'tree_feature': np.array(self.feature, dtype=np.int32),
+            'tree_threshold': np.array(self.threshold, dtype=np.float64),
+            'tree_left': np.array(self.left, dtype=np.int32),
+            'tree_right': np.array(self.right, dtype=np.int32),
+            'tree_value': np.array(self.value, dtype=np.float64),
+            'tree_roots': np.array(self.roots, dtype=np.int32),
+        }
+        if with_missing:
+            arrays['tree_default_left'] = np.array(self.default_left, dtype=bool)
+            arrays['tree_missing_type'] = np.array(self.missing_type, dtype=np.int8)
+        return arrays
+
+
+def _add_lightgbm_tree(builder, node, depth=0):
+    builder.max_depth = max(builder.max_depth, depth)
+    if 'leaf_value' in node:
+        return builder.add_node(value=node['leaf_value'])
+    if node['decision_type'] != '<=':
+        raise ValueError(f"Unsupported LightGBM split type: {node['decision_type']}")
+    index = builder.add_node(feature=node['split_feature'], threshold=node['threshold'],
+                             default_left=node['default_left'],
+                             missing_type=LGBM_MISSING_TYPES[node['missing_type']])
+    builder.left[index] = _add_lightgbm_tree(builder, node['left_child'], depth + 1)
+    builder.right[index] = _add_lightgbm_tree(builder, node['right_child'], depth + 1)
+    return index
+
+
+def flatten_lightgbm(booster):
+    dump = booster.dump_model()
+    if dump.get('num_tree_per_iteration', 1) != 1:
+        raise ValueError("Only binary LightGBM models can be compiled")
+    objective = dump.get('objective', '')
+    if not objective.startswith('binary'):
+        raise ValueError(f"Unsupported LightGBM objective: {objective}")
+    sigmoid = 1.0
+    for part in objective.split():
+        if part.startswith('sigmoid:'):
+            sigmoid = float(part.split(':')[1])
+
+    builder = _TreeBuilder()
+    for tree in dump['tree_info']:
+        builder.roots.append(_add_lightgbm_tree(builder, tree['tree_structure']))
+    return builder, sigmoid
+
+
+def flatten_isolation_forest(model):
+    builder = _TreeBuilder()
+    for tree, features in zip(model.estimators_, model.estimators_features_):
+        t = tree.tree_
+        # Path length of a row ending in a leaf, as in IsolationForest._compute_score_samples
+        path_lengths = t.compute_node_depths() + _average_path_length(t.n_node_samples) - 1.0
+        offset = len(builder.feature)
+        is_leaf = t.children_left == -1
+        for node in range(t.node_count):
+            if is_leaf[node]:
+                builder.add_node(value=path_lengths[node])
+            else:
+                index = builder.add_node(feature=int(features[t.feature[node]]), threshold=t.threshold[node])
+                builder.left[index] = offset + t.children_left[node]
+                builder.right[index] = offset + t.children_right[node]
+        builder.roots.append(offset)
+        builder.max_depth = max(builder.max_depth, tree.get_depth())
+    return builder
+
+
+# ==============================================================================
+# SECTION 2: COMPILERS
+# ==============================================================================
+
+def _steps(transformer):
+    if transformer == 'passthrough':
+        return []
+    return [step for _, step in transformer.steps] if hasattr(transformer, 'steps') else [transformer]
+
+
+# CompiledPipeline always imputes first, then scales or encodes, so only these
+# step orders can be reproduced
+BRANCH_LAYOUTS = {
+    (), ('imputer',), ('scaler',), ('cyclical_encoder',),
+    ('imputer', 'scaler'), ('imputer', 'cyclical_encoder'),
+}
+
+
+def _step_kind(step, name):
+    if isinstance(step, SimpleImputer):
+        return 'imputer'
+    if isinstance(step, StandardScaler):
+        return 'scaler'
+    if isinstance(step, FunctionTransformer) and getattr(step.func, '__name__', None) == 'cyclical_encoder':
+        return 'cyclical_encoder'
+    raise ValueError(f"Cannot compile step {type(step).__name__} of transformer '{name}'")
+
+
+def compile_sybil_pipeline(pipeline):
+    """Compiles the fitted Sybil pipeline (see notebooks/train_aptos.ipynb) into a CompiledPipeline."""
+    steps = [step for _, step in pipeline.steps if not hasattr(step, 'fit_resample')]  # SMOTE is fit-only
+    preprocessor, model = steps[0], steps[-1]
+    selectors = steps[1:-1]
+    input_columns = list(preprocessor.feature_names_in_)
+
+    affine = {'cols': [], 'fill': [], 'mean': [], 'scale': []}
+    cyclic = {'cols': [], 'fill': [], 'period': []}
+    layout = []  # position of every ColumnTransformer output in [affine outputs, cyclic outputs]
+
+    for name, transformer, columns in preprocessor.transformers_:
+        if transformer == 'drop' or len(columns) == 0:
+            continue
+        cols = [input_columns.index(c) if isinstance(c, str) else int(c) for c in columns]
+        fill = [np.nan] * len(cols)
+        mean = [0.0] * len(cols)
+        scale = [1.0] * len(cols)
+        periods = None
+        kinds = tuple(_step_kind(step, name) for step in _steps(transformer))
+        if kinds not in BRANCH_LAYOUTS:
+            raise ValueError(f"Cannot compile transformer '{name}': steps {' -> '.join(kinds)} "
+                             f"(expected imputer -> scaler or imputer -> cyclical_encoder)")
+        for step, kind in zip(_steps(transformer), kinds):
+            if kind == 'imputer':
+                fill = [float(v) for v in step.statistics_]
+            elif kind == 'scaler':
+                if step.with_mean:
+                    mean = list(step.mean_)
+                if step.with_std:
+                    scale = list(step.scale_)
+            else:
+                periods = [m + 1 for m in CYCLICAL_MAX_VALUES[:len(cols)]]
+
+        if periods is None:
+            for i in range(len(cols)):
+                layout.append(('affine', len(affine['cols']) + i))
+            affine['cols'] += cols
+            affine['fill'] += fill
+            affine['mean'] += mean
+            affine['scale'] += scale
+        else:
+            for i in range(len(cols)):
+                k = len(cyclic['cols']) + i
+                layout += [('cyclic', 2 * k), ('cyclic', 2 * k + 1)]
+            cyclic['cols'] += cols
+            cyclic['fill'] += fill
+            cyclic['period'] += periods
+
+    n_affine = len(affine['cols'])
+    source_index = np.array([i if kind == 'affine' else n_affine + i for kind, i in layout], dtype=np.int64)
+    for selector in selectors:
+        if not isinstance(selector, SelectFromModel):
+            raise ValueError(f"Cannot compile step {type(selector).__name__}")
+        source_index = source_index[selector.get_support(indices=True)]
+
+    builder, sigmoid = flatten_lightgbm(model.booster_)
+    arrays = {
+        'affine_cols': np.array(affine['cols'], dtype=np.int64),
+        'affine_fill': np.array(affine['fill'], dtype=np.float64),
+        'affine_mean': np.array(affine['mean'], dtype=np.float64),
+        'affine_scale': np.array(affine['scale'], dtype=np.float64),
+        'cyclic_cols': np.array(cyclic['cols'], dtype=np.int64),
+        'cyclic_fill': np.array(cyclic['fill'], dtype=np.float64),
+        'cyclic_period': np.array(cyclic['period'], dtype=np.float64),
+        'source_index': source_index,
+        **builder.arrays(with_missing=True),
+    }
+    return CompiledPipeline(input_columns, model.classes_, arrays, builder.max_depth, sigmoid)
+
+
+def compile_isolation_forest(model, scaler):
+    """Compiles a fitted StandardScaler + IsolationForest pair into a CompiledIsolationForest."""
+    if not isinstance(model, IsolationForest):
+        raise ValueError(f"Expected an IsolationForest, got {type(model).__name__}")
+    n_features = model.n_features_in_
+    try:
+        input_columns = scaler.feature_names_in_.tolist()
+    except AttributeError:
+        input_columns = [f"feature_{i + 1}" for i in range(n_features)]
+
+    builder = flatten_isolation_forest(model)
+    arrays = {
+        'scaler_mean': np.asarray(scaler.mean_ if scaler.with_mean else np.zeros(n_features), dtype=np.float64),
+        'scaler_scale': np.asarray(scaler.scale_ if scaler.with_std else np.ones(n_features), dtype=np.float64),
+        **builder.arrays(with_missing=False),
+    }
+    denominator = len(model.estimators_) * _average_path_length([model._max_samples])[0]
+    return CompiledIsolationForest(input_columns, arrays, builder.max_depth, denominator, model.offset_)
+
+
+# ==============================================================================
+# SECTION 3: EXPORT AND CHECK
+# ==============================================================================
+
+def _sample_rows(mean, scale, n, seed=42):
+    rng = np.random.default_rng(seed)
+    return mean + scale * rng.normal(0, 2, size=(n, len(mean)))
+
+
+def check_sybil(compiled, pipeline, n=2000):
+    """
+    Max |probability difference| against the sklearn pipeline on synthetic
+    rows, about 10% of their values missing.
+    Raises ValueError if any predicted label differs.
+    """
+    import pandas as pd
+    X = _sample_rows(np.zeros(len(compiled.input_columns)), np.ones(len(compiled.input_columns)), n)
+    X[:, compiled.affine_cols] = _sample_rows(compiled.affine_mean, compiled.affine_scale, n)
+    X[:, compiled.cyclic_cols] = np.random.default_rng(7).integers(0, 24, size=(n, len(compiled.cyclic_cols)))
+    X[np.random.default_rng(11).random(X.shape) < 0.1] = np.nan  # missing values (JSON null, absent features)
+    frame = pd.DataFrame(X, columns=compiled.input_columns)
+    mismatched = int(np.count_nonzero(compiled.predict(X) != pipeline.predict(frame)))
+    if mismatched:
+        raise ValueError(f"{mismatched} of {n} predicted labels differ from the sklearn pipeline")
+    return float(np.max(np.abs(compiled.predict_proba(X) - pipeline.predict_proba(frame))))
+
+
+def check_isolation_forest(compiled, model, scaler, n=2000):
+    """Max |decision_function difference| against the sklearn model on synthetic rows."""
+    X_scaled = scaler.transform(_sample_rows(scaler.mean_, scaler.scale_, n))
+    return float(np.max(np.abs(compiled.decision_function(X_scaled) - model.decision_function(X_scaled))))
+
+
+def compiled_path(path):
+    return os.path.splitext(path)[0] + '.compiled.npz'
+
+
+def main(argv):
+    if len(argv) >= 2 and argv[0] == 'sybil':
+        # Pipeline được pickle từ notebook nên tham chiếu tới __main__.cyclical_encoder
+        sys.modules['__main__'].cyclical_encoder = cyclical_encoder
+        pipeline = joblib.load(argv[1])
+        compiled = compile_sybil_pipeline(pipeline)
+        output = compiled_path(argv[1])
+        save_compiled_model(compiled, output)
+        try:
+            max_diff = check_sybil(load_compiled_model(output), pipeline)
+        except ValueError as e:
+            # Không để lại artifact sai, app sẽ ưu tiên dùng nó
+            os.remove(output)
+            print(f"❌ Compiled model does not match the sklearn pipeline: {e}")
+            return 1
+    elif len(argv) >= 3 and argv[0] == 'isolation-forest':
+        model, scaler = joblib.load(argv[1]), joblib.load(argv[2])
+        compiled = compile_isolation_forest(model, scaler)
+        output = compiled_path(argv[1])
+        save_compiled_model(compiled, output)
+        max_diff = check_isolation_forest(load_compiled_model(output), model, scaler)
+    else:
+        print("Usage: python -m src.export_compiled_model sybil <pipeline.joblib>\n"
+              "       python -m src.export_compiled_model isolation-forest <model.joblib> <scaler.pkl>")
+        return 2
+
+    print(f"✅ Compiled model written to {output} (max difference vs sklearn: {max_diff:.3g})")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
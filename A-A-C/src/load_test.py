@@ -0,0 +1,470 @@
+# src/load_test.py
+# Load generator for the AI services. Starts a stub Aptos fullnode, runs the
+# service under gunicorn for every worker configuration, drives /predict and
+# /predict/batch at each concurrency level and reports throughput, latency
+# percentiles and error rates.
+#
+# Usage (from A-A-C/):
+#   python -m src.load_test --workers 1,2,4 --worker-class sync,gthread --concurrency 1,8,32
+#   python -m src.load_test --service rugpull --chdir <dir containing RugPullDetectionModel/>
+#   python -m src.load_test --url http://127.0.0.1:5000 --stub-port 8090   (service already running,
+#                                                                         with APTOS_NODE_URL=http://127.0.0.1:8090/v1)
+
+import argparse
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+import numpy as np
+import requests
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+APT_COIN_STORE = "0x1::coin::CoinStore<0x1::aptos_coin::AptosCoin>"
+DEFAULT_WALLET_MIX = '10:0.6,250:0.3,2000:0.1'
+SERVICE_APPS = {'sybil': 'src.app:app', 'rugpull': 'RugPullDetectionModel.app:app'}
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# ==============================================================================
+# SECTION 1: STUB FULLNODE
+# ==============================================================================
+
+def parse_wallet_mix(text):
+    """Parses 'tx_count:weight,...' into a list of (tx_count, probability)."""
+    mix = []
+    for part in text.split(','):
+        tx_count, weight = part.split(':')
+        mix.append((int(tx_count), float(weight)))
+    total = sum(weight for _, weight in mix)
+    return [(tx_count, weight / total) for tx_count, weight in mix]
+
+
+def make_wallets(n, mix, seed=0):
+    """
+    Random wallet addresses whose transaction count is drawn from `mix`.
+    The count is encoded in the first 16 hex digits of the address, so the
+    stub fullnode can serve any wallet without shared state.
+    """
+    rng = random.Random(seed)
+    sizes = rng.choices([tx_count for tx_count, _ in mix], weights=[w for _, w in mix], k=n)
+    return [f'0x{size:016x}{rng.getrandbits(192):048x}' for size in sizes]
+
+
+def wallet_tx_count(address):
+    try:
+        return int(address[2:18], 16)
+    except ValueError:
+        return 0
+
+
+def _address(*parts):
+    return '0x' + hashlib.sha256(':'.join(map(str, parts)).encode()).hexdigest()
+
+
+# Popular contracts shared by every wallet (hubs), plus a few per wallet group
+POPULAR_CONTRACTS = [_address('popular', i) for i in range(8)]
+
+
+def stub_transaction(address, index):
+    """Deterministic synthetic transaction `index` of `address`, shaped like the fullnode JSON."""
+    rng = random.Random(f'{address}:{index}')
+    group = int(address[-4:], 16) % 64
+    counterparties = [_address('group', group, i) for i in range(6)]
+    contract = rng.choice(POPULAR_CONTRACTS + counterparties[:2])
+    return {
+        'version': str(1000000 + index),
+        'hash': _address(address, index),
+        'sender': address if index == 0 or rng.random() < 0.9 else rng.choice(counterparties),
+        'sequence_number': str(index),
+        'success': rng.random() < 0.95,
+        'vm_status': 'Executed successfully',
+        'timestamp': str((1_650_000_000 + index * 3_600 + rng.randint(0, 3_599)) * 1_000_000),
+        'payload': {
+            'type': 'entry_function_payload',
+            'function': f'{contract}::router::swap',
+            'type_arguments': ['0x1::aptos_coin::AptosCoin'],
+            'arguments': [rng.choice(counterparties), str(rng.randint(1, 10 ** 8))],
+        },
+        'events': [{'type': '0x1::coin::WithdrawEvent', 'data': {'amount': str(rng.randint(1, 10 ** 8))}}],
+        'signature': {'type': 'ed25519_signature', 'public_key': '0x' + '0' * 64, 'signature': '0x' + '0' * 128},
+    }
+
+
+def stub_resources(address):
+    tx_count = wallet_tx_count(address)
+    resources = [{'type': '0x1::account::Account', 'data': {'sequence_number': str(tx_count)}}]
+    if tx_count:
+        resources.append({'type': APT_COIN_STORE, 'data': {'coin': {'value': str(tx_count * 12_345_678)}}})
+    resources += [{'type': f'0x1::coin::CoinStore<{_address("coin", i)}::coin::T>', 'data': {'coin': {'value': '1'}}}
+                  for i in range(tx_count % 7)]
+    return resources
+
+
+class StubFullnodeHandler(BaseHTTPRequestHandler):
+    """Serves the account endpoints used by utils.py from synthetic data."""
+
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real fullnode
+
+    def do_GET(self):
+        if self.server.latency_seconds:
+            time.sleep(self.server.latency_seconds)
+        url = urlparse(self.path)
+        parts = [unquote(p) for p in url.path.split('/') if p]
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if len(parts) < 4 or parts[:2] != ['v1', 'accounts']:
+            return self._send(404, {'message': 'not found'})
+
+        address = parts[2]
+        if parts[3] == 'transactions':
+            start, limit = int(params.get('start', 0)), int(params.get('limit', 25))
+            end = min(start + limit, wallet_tx_count(address))
+            return self._send(200, [stub_transaction(address, i) for i in range(start, end)])
+        if parts[3] == 'resource':
+            matches = [r for r in stub_resources(address) if r['type'] == '/'.join(parts[4:])]
+            return self._send(200, matches[0]) if matches else self._send(404, {'message': 'resource not found'})
+        if parts[3] == 'resources':
+            resources = stub_resources(address)
+            start, limit = int(params.get('start', 0)), int(params.get('limit', 9999))
+            headers = {'X-Aptos-Cursor': str(start + limit)} if start + limit < len(resources) else {}
+            return self._send(200, resources[start:start + limit], headers)
+        return self._send(404, {'message': 'not found'})
+
+    def _send(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run_stub_fullnode(port, latency_seconds):
+    server = ThreadingHTTPServer(('127.0.0.1', port), StubFullnodeHandler)
+    server.daemon_threads = True
+    server.latency_seconds = latency_seconds
+    server.serve_forever()
+
+
+def start_stub_fullnode(port=0, latency_seconds=0.0):
+    """Runs the stub fullnode in its own process (so it does not share the load generator's GIL)."""
+    port = port or free_port()
+    process = multiprocessing.Process(target=run_stub_fullnode, args=(port, latency_seconds), daemon=True)
+    process.start()
+    wait_for_port(port)
+    return process, f'http://127.0.0.1:{port}/v1'
+
+
+# ==============================================================================
+# SECTION 2: SERVICE UNDER TEST
+# ==============================================================================
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f'Nothing is listening on port {port}')
+
+
+def start_service(app_module, chdir, workers, worker_class, threads, node_url, log_path, state_dir):
+    """
+    Starts the service under gunicorn; returns (process, base URL). The
+    watchlist and counterparty index live in `state_dir`, so a run never
+    writes into the checked-out tree.
+    """
+    port = free_port()
+    env = {**os.environ, 'PYTHONPATH': chdir, 'APTOS_NODE_URL': node_url, 'PREDICTION_LOG_DIR': '',
+           'WATCHLIST_FILE': os.path.join(state_dir, 'watchlist.json'),
+           'COUNTERPARTY_INDEX_PATH': os.path.join(state_dir, 'counterparty_index.npz')}
+    command = [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}', '--workers', str(workers),
+               '--worker-class', worker_class, '--threads', str(threads), '--keep-alive', '75',
+               '--timeout', '120', app_module]
+    with open(log_path, 'ab') as log:
+        process = subprocess.Popen(command, cwd=chdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    return process, f'http://127.0.0.1:{port}'
+
+
+def wait_ready(url, process=None, timeout=300, consecutive=1):
+    """
+    Waits until /ready answers 200 `consecutive` times in a row (each
+    worker loads its model separately, so ask more than once).
+    """
+    deadline = time.monotonic() + timeout
+    successes = 0
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f'Service exited with code {process.returncode} before becoming ready')
+        try:
+            successes = successes + 1 if requests.get(f'{url}/ready', timeout=5).status_code == 200 else 0
+        except requests.exceptions.RequestException:
+            successes = 0
+        if successes >= consecutive:
+            return
+        time.sleep(0.5 if successes == 0 else 0.05)
+    raise RuntimeError(f'Service at {url} was not ready after {timeout}s')
+
+
+def stop_service(process):
+    process.terminate()
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+# ==============================================================================
+# SECTION 3: LOAD GENERATION
+# ==============================================================================
+
+def sybil_workload(wallets, batch_size):
+    """Request builders (path, body, items) for the Sybil service, by endpoint."""
+    return {
+        'single': lambda rng: ('/predict', {'wallet_address': rng.choice(wallets)}, 1),
+        'batch': lambda rng: ('/predict/batch', {'wallet_addresses': rng.sample(wallets, batch_size)}, batch_size),
+    }
+
+
+def rugpull_workload(feature_names, batch_size):
+    """Request builders for the rug-pull service; batches use the compact columns + rows form."""
+    def row(rng):
+        return [rng.uniform(0, 100) for _ in feature_names]
+
+    return {
+        'single': lambda rng: ('/predict', dict(zip(feature_names, row(rng))), 1),
+        'batch': lambda rng: ('/predict/batch',
+                              {'columns': feature_names, 'rows': [row(rng) for _ in range(batch_size)]},
+                              batch_size),
+    }
+
+
+def rugpull_feature_names(url):
+    response = requests.get(f'{url}/test-sample', timeout=120)
+    response.raise_for_status()
+    return list(response.json()['input_sample'])
+
+
+def encode_request(body, wire_format):
+    if wire_format == 'msgpack':
+        return msgpack.packb(body), {'Content-Type': 'application/msgpack', 'Accept': 'application/msgpack'}
+    return json.dumps(body).encode(), {'Content-Type': 'application/json'}
+
+
+def decode_response(response):
+    if 'msgpack' in response.headers.get('Content-Type', ''):
+        return msgpack.unpackb(response.content)
+    return response.json()
+
+
+def run_level(url, build_request, concurrency, duration, warmup, wire_format, seed=0, timeout=120):
+    """
+    Closed-loop load: `concurrency` clients (each with its own keep-alive
+    Session) send requests back to back for `warmup + duration` seconds.
+    Only requests started after the warmup are measured.
+    """
+    started = time.monotonic()
+    measure_from, deadline = started + warmup, started + warmup + duration
+    samples = []  # (latency seconds, ok, items, item errors)
+    lock = threading.Lock()
+
+    def client(index):
+        rng = random.Random(seed * 1000 + index)
+        session = requests.Session()
+        while True:
+            sent = time.monotonic()
+            if sent >= deadline:
+                break
+            path, body, items = build_request(rng)
+            data, headers = encode_request(body, wire_format)
+            ok, item_errors = False, 0
+            try:
+                response = session.post(f'{url}{path}', data=data, headers=headers, timeout=timeout)
+                ok = response.status_code == 200
+                if ok and items > 1:
+                    item_errors = sum(1 for r in decode_response(response)['results'] if 'error' in r)
+            except requests.exceptions.RequestException:
+                pass
+            latency = time.monotonic() - sent
+            if sent >= measure_from:
+                with lock:
+                    samples.append((latency, ok, items, item_errors))
+
+    threads = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = max(time.monotonic() - measure_from, 1e-9)
+    return summarize(samples, elapsed)
+
+
+# ==============================================================================
+# SECTION 4: REPORT
+# ==============================================================================
+
+def summarize(samples, elapsed):
+    if not samples:
+        return {'requests': 0, 'errors': 0, 'error_rate': None, 'throughput_rps': 0.0, 'items_per_second': 0.0,
+                'item_error_rate': None, 'p50_ms': None, 'p95_ms': None, 'p99_ms': None, 'mean_ms': None}
+    latencies = np.array([s[0] for s in samples]) * 1000
+    errors = sum(1 for s in samples if not s[1])
+    items = sum(s[2] for s in samples if s[1])
+    item_errors = sum(s[3] for s in samples)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'error_rate': errors / len(samples),
+        'throughput_rps': len(samples) / elapsed,
+        'items_per_second': (items - item_errors) / elapsed,
+        'item_error_rate': item_errors / items if items else None,
+        'p50_ms': float(p50), 'p95_ms': float(p95), 'p99_ms': float(p99),
+        'mean_ms': float(latencies.mean()),
+    }
+
+
+REPORT_COLUMNS = [
+    ('workers', '{}'), ('worker_class', '{}'), ('threads', '{}'), ('endpoint', '{}'), ('concurrency', '{}'),
+    ('requests', '{}'), ('throughput_rps', '{:.1f}'), ('items_per_second', '{:.1f}'),
+    ('p50_ms', '{:.1f}'), ('p95_ms', '{:.1f}'), ('p99_ms', '{:.1f}'), ('error_rate', '{:.2%}'),
+]
+
+
+def format_report(rows):
+    table = [[name for name, _ in REPORT_COLUMNS]]
+    for row in rows:
+        table.append(['-' if row.get(name) is None else fmt.format(row[name]) for name, fmt in REPORT_COLUMNS])
+    widths = [max(len(line[i]) for line in table) for i in range(len(REPORT_COLUMNS))]
+    return '\n'.join('  '.join(cell.rjust(width) for cell, width in zip(line, widths)) for line in table)
+
+
+def parse_list(text, cast=str):
+    return [cast(item) for item in text.split(',') if item]
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='python -m src.load_test',
+                                     description='Load test the AI services against a stub Aptos fullnode.')
+    parser.add_argument('--service', choices=sorted(SERVICE_APPS), default='sybil')
+    parser.add_argument('--app', help='gunicorn app module (default: depends on --service)')
+    parser.add_argument('--chdir', help='directory gunicorn runs from (default: A-A-C/ for the Sybil service)')
+    parser.add_argument('--url', help='test an already running service instead of starting gunicorn')
+    parser.add_argument('--workers', default='2', help='comma-separated gunicorn worker counts')
+    parser.add_argument('--worker-class', default='sync', help='comma-separated gunicorn worker classes')
+    parser.add_argument('--threads', default='4', help='comma-separated thread counts (gthread workers)')
+    parser.add_argument('--concurrency', default='1,4,16', help='comma-separated numbers of concurrent clients')
+    parser.add_argument('--endpoints', default='single,batch', help='single, batch or both')
+    parser.add_argument('--batch-size', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=30, help='measured seconds per level')
+    parser.add_argument('--warmup', type=float, default=5, help='unmeasured seconds before each level')
+    parser.add_argument('--wallets', type=int, default=500, help='number of distinct synthetic wallets')
+    parser.add_argument('--wallet-mix', default=DEFAULT_WALLET_MIX, help='tx_count:weight,... of synthetic wallets')
+    parser.add_argument('--node-latency-ms', type=float, default=0, help='added latency of every stub fullnode call')
+    parser.add_argument('--stub-port', type=int, default=0)
+    parser.add_argument('--wire-format', choices=['json', 'msgpack'], default='json')
+    parser.add_argument('--ready-timeout', type=float, default=300)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='also write the results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    args.app = args.app or SERVICE_APPS[args.service]
+    if args.chdir is None and args.service == 'sybil':
+        args.chdir = PROJECT_DIR
+    if args.url is None and args.chdir is None:
+        parser.error('--chdir (or --url) is required for the rug-pull service')
+    if args.wire_format == 'msgpack' and msgpack is None:
+        parser.error('--wire-format msgpack needs the msgpack package')
+    return args
+
+
+def load_configuration(args, url, config):
+    """Runs every endpoint and concurrency level against one running service."""
+    if args.service == 'sybil':
+        wallets = make_wallets(args.wallets, parse_wallet_mix(args.wallet_mix), args.seed)
+        workload = sybil_workload(wallets, min(args.batch_size, len(wallets)))
+    else:
+        workload = rugpull_workload(rugpull_feature_names(url), args.batch_size)
+
+    rows = []
+    for endpoint, concurrency in itertools.product(parse_list(args.endpoints), parse_list(args.concurrency, int)):
+        print(f"  - {endpoint} x{concurrency} ({args.warmup:g}s warmup + {args.duration:g}s)...")
+        stats = run_level(url, workload[endpoint], concurrency, args.duration, args.warmup, args.wire_format,
+                          seed=args.seed)
+        rows.append({**config, 'endpoint': endpoint, 'concurrency': concurrency, **stats})
+    return rows
+
+
+def main(argv):
+    args = parse_args(argv)
+    stub, node_url = start_stub_fullnode(args.stub_port, args.node_latency_ms / 1000)
+    print(f"Stub fullnode at {node_url} (latency {args.node_latency_ms:g} ms)")
+
+    rows = []
+    try:
+        if args.url:
+            wait_ready(args.url, timeout=args.ready_timeout)
+            rows += load_configuration(args, args.url,
+                                       {'workers': None, 'worker_class': 'external', 'threads': None})
+        else:
+            log_path = os.path.join(tempfile.gettempdir(), f'load_test_{args.service}.log')
+            # --threads only applies to gthread workers
+            configs = dict.fromkeys((workers, worker_class, threads if worker_class == 'gthread' else 1)
+                                    for workers, worker_class, threads in itertools.product(
+                                        parse_list(args.workers, int), parse_list(args.worker_class),
+                                        parse_list(args.threads, int)))
+            for workers, worker_class, threads in configs:
+                config = {'workers': workers, 'worker_class': worker_class, 'threads': threads}
+                print(f"Starting {args.app} with {workers} {worker_class} worker(s) x {threads} thread(s)"
+                      f" (log: {log_path})")
+                # Fresh watchlist/index per configuration so earlier runs do not skew the next one
+                with tempfile.TemporaryDirectory(prefix='load_test_') as state_dir:
+                    process, url = start_service(args.app, args.chdir, workers, worker_class, threads, node_url,
+                                                 log_path, state_dir)
+                    try:
+                        wait_ready(url, process, args.ready_timeout, consecutive=2 * workers)
+                        rows += load_configuration(args, url, config)
+                    finally:
+                        stop_service(process)
+    finally:
+        stub.terminate()
+
+    print()
+    print(format_report(rows))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'arguments': vars(args), 'results': rows}, f, indent=2)
+        print(f"\n✅ Results written to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,37 @@
+# src/prediction_cache.py
+# In-process cache of prediction results, shared by the /predict endpoint and
+# the background watchlist scheduler.
+
+import threading
+import time
+
+
+class PredictionCache:
+    """Thread-safe map of wallet address -> latest prediction result, with a TTL."""
+
+    def __init__(self, ttl_seconds=900):
+        self.ttl_seconds = ttl_seconds
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, address):
+        """Returns the cached result for `address`, or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(address)
+        if entry is None:
+            return None
+        stored_at, result = entry
+        if time.monotonic() - stored_at > self.ttl_seconds:
+            return None
+        return result
+
+    def put(self, address, result):
+        with self._lock:
+            self._entries[address] = (time.monotonic(), result)
+
+    def discard(self, address):
+        with self._lock:
+            self._entries.pop(address, None)
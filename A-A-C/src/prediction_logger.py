@@ -0,0 +1,184 @@
+# src/prediction_logger.py
+# Non-blocking logging of predictions in the feature-row format.
+# Request threads only enqueue a dict; a background thread serialises the
+# records in batches and appends them to rotating NDJSON segments.
+
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+
+def _to_json(value):
+    # NumPy scalars coming from the feature DataFrame
+    if hasattr(value, 'item'):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except OSError:  # e.g. Windows, where signal 0 is not supported
+        return True
+    return True
+
+
+class PredictionLogger:
+    """
+    Buffered writer of prediction records.
+
+    `log()` never blocks: when the queue is full (or the writer thread has
+    died, see `error`) the record is dropped and counted in `dropped`. The writer thread flushes every `batch_size`
+    records or `flush_seconds`, whichever comes first. Each process appends to
+    its own segment `<directory>/prediction_log-<pid>.ndjson` (gunicorn runs
+    several workers); once it exceeds `max_segment_bytes` it is renamed with
+    a UTC timestamp and only the newest `backup_count` rotated segments of
+    the directory are kept. Segments left behind by processes that are no
+    longer running are rotated the same way, so the directory stays bounded.
+    `close()` flushes the queue and is registered with atexit by `start()`.
+    """
+
+    def __init__(self, directory, max_queue=10000, batch_size=256, flush_seconds=1.0,
+                 max_segment_bytes=64 * 1024 * 1024, backup_count=20):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_segment_bytes = max_segment_bytes
+        self.backup_count = backup_count
+        self.written = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.error = None  # why the writer thread stopped, if it died
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, f'prediction_log-{os.getpid()}.ndjson')
+
+    def start(self):
+        """Starts the writer thread; calling it again is a no-op."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='prediction-logger', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def log(self, record):
+        """Enqueues a record (dict). Returns False if it was dropped."""
+        record.setdefault('logged_at', datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC'))
+        if self.error is None:
+            try:
+                self._queue.put_nowait(record)
+                return True
+            except queue.Full:
+                pass
+        with self._lock:
+            self.dropped += 1
+        return False
+
+    def close(self):
+        """Stops the writer thread after flushing what is still queued."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def status(self):
+        with self._lock:
+            written, dropped = self.written, self.dropped
+        return {
+            'queued': self._queue.qsize(),
+            'written': written,
+            'dropped': dropped,
+            'segment': self.path,
+            'writer_alive': self._thread is not None and self._thread.is_alive(),
+            'error': self.error,
+        }
+
+    def _run(self):
+        try:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                self._rotate_orphaned_segments()
+            except OSError as e:
+                # Writes retry (and count as dropped) until the directory is usable
+                print(f"Warning: Could not prepare prediction log directory {self.directory}: {e}")
+            while not (self._stop.is_set() and self._queue.empty()):
+                batch = self._next_batch()
+                if batch:
+                    try:
+                        self._write(batch)
+                    except (OSError, TypeError, ValueError) as e:
+                        with self._lock:
+                            self.dropped += len(batch)
+                        print(f"Warning: Could not write prediction log: {e}")
+        except Exception as e:
+            self.error = f'{type(e).__name__}: {e}'
+            print(f"Warning: Prediction logger stopped: {self.error}")
+            raise
+
+    def _next_batch(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_seconds
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        data = ''.join(json.dumps(record, default=_to_json, ensure_ascii=False) + '\n' for record in batch)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(data)
+            size = f.tell()
+        with self._lock:
+            self.written += len(batch)
+        if size >= self.max_segment_bytes:
+            try:
+                self._rotate()
+            except OSError as e:
+                print(f"Warning: Could not rotate prediction log: {e}")
+
+    def _rotate(self):
+        self._rotate_segment(self.path, os.getpid(), datetime.now(timezone.utc))
+        self._rotate_orphaned_segments()
+
+    def _rotate_segment(self, path, pid, rotated_at):
+        stamp = rotated_at.strftime('%Y%m%dT%H%M%S%f')
+        os.replace(path, os.path.join(self.directory, f'prediction_log-{stamp}-{pid}.ndjson'))
+
+    def _rotate_orphaned_segments(self):
+        """Rotates the active segments of processes that have exited, then prunes old rotated segments."""
+        for name in os.listdir(self.directory):
+            pid = name[len('prediction_log-'):-len('.ndjson')]
+            if not (name.startswith('prediction_log-') and name.endswith('.ndjson') and pid.isdigit()):
+                continue
+            if int(pid) == os.getpid() or _process_alive(int(pid)):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                rotated_at = datetime.fromtimestamp(os.path.getmtime(path), tz=timezone.utc)
+                self._rotate_segment(path, pid, rotated_at)
+            except FileNotFoundError:
+                pass  # rotated by another worker
+        # Rotated names sort by time; active segments (prediction_log-<pid>) do not match.
+        rotated = sorted(name for name in os.listdir(self.directory)
+                         if name.startswith('prediction_log-') and name.count('-') == 2)
+        for name in rotated[:-self.backup_count] if self.backup_count else rotated:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass  # pruned by another worker
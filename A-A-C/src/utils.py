@@ -2,15 +2,23 @@
 # This file contains utility functions for the Aptos Sybil detection project.
 # It handles data fetching from the blockchain and feature engineering.
 
-import pandas as pd
 import numpy as np
+import os
 import requests
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from datetime import datetime, timezone
-import collections
 
 # --- Constants ---
-NODE_URL = "https://fullnode.mainnet.aptoslabs.com/v1"
+NODE_URL = os.environ.get("APTOS_NODE_URL", "https://fullnode.mainnet.aptoslabs.com/v1")
+APT_COIN_STORE = "0x1::coin::CoinStore<0x1::aptos_coin::AptosCoin>"
+COIN_STORE_PREFIX = "0x1::coin::CoinStore<"
+RESOURCES_PAGE_SIZE = 1000
+RESOURCE_LOOKUP_TIMEOUT = float(os.environ.get("RESOURCE_LOOKUP_TIMEOUT", 30))
+
+# Max values for: hour (0-23), day_of_week (0-6), month (1-12)
+CYCLICAL_MAX_VALUES = [23, 6, 12]
 
 
 # ==============================================================================
@@ -24,11 +32,9 @@ def cyclical_encoder(X):
     pipeline when loading the model.
     """
     X_encoded = np.array([])
-    # Max values for: hour (0-23), day_of_week (0-6), month (1-12)
-    max_vals = [23, 6, 12]
     for i in range(X.shape[1]):
         col_data = X[:, i:i + 1]
-        max_val = max_vals[i]
+        max_val = CYCLICAL_MAX_VALUES[i]
         # Sine and Cosine transformation
         X_sin = np.sin(2 * np.pi * col_data / (max_val + 1))
         X_cos = np.cos(2 * np.pi * col_data / (max_val + 1))
@@ -43,10 +49,259 @@ def cyclical_encoder(X):
 # SECTION 2: BLOCKCHAIN DATA FETCHING FUNCTIONS
 # ==============================================================================
 
-def get_all_transactions(session, address):
-    """Fetches all transactions for a given address from the Aptos fullnode."""
-    all_transactions = []
-    start = 0
+def get_apt_balance(session, address):
+    """Reads the APT balance from the AptosCoin CoinStore resource alone (0 if the account has none)."""
+    try:
+        response = session.get(f"{NODE_URL}/accounts/{address}/resource/{APT_COIN_STORE}",
+                               timeout=RESOURCE_LOOKUP_TIMEOUT)
+        if response.status_code == 404:
+            return 0
+        response.raise_for_status()
+        return int(response.json()['data']['coin']['value']) / 10 ** 8
+    except (requests.exceptions.RequestException, KeyError, TypeError, ValueError):
+        return 0
+
+
+def count_other_coin_stores(session, address, cancelled=None):
+    """
+    Counts the non-APT CoinStore resources of an account, one page of
+    resources at a time (following the X-Aptos-Cursor header), keeping
+    only the running count. Stops early once `cancelled` (an Event) is set.
+    """
+    count = 0
+    params = {'limit': RESOURCES_PAGE_SIZE}
+    while cancelled is None or not cancelled.is_set():
+        try:
+            response = session.get(f"{NODE_URL}/accounts/{address}/resources", params=params,
+                                   timeout=RESOURCE_LOOKUP_TIMEOUT)
+            response.raise_for_status()
+            resources = response.json()
+        except requests.exceptions.RequestException:
+            print(f"Warning: Could not fetch all resources for {address}.")
+            break
+        for resource in resources:
+            resource_type = resource.get('type', '')
+            if resource_type.startswith(COIN_STORE_PREFIX) and resource_type != APT_COIN_STORE:
+                count += 1
+        cursor = response.headers.get('X-Aptos-Cursor')
+        if not cursor or not resources:
+            break
+        params = {'limit': RESOURCES_PAGE_SIZE, 'start': cursor}
+    return count
+
+
+def get_coin_summary(session, address):
+    """APT balance and number of other coin stores of an account."""
+    return {
+        'apt_balance': get_apt_balance(session, address),
+        'other_token_count': count_other_coin_stores(session, address),
+    }
+
+
+# Resource lookups run on bounded thread pools (each thread with its own
+# Session) while the caller pages through the wallet's transactions.
+# Request callers (/predict, /predict/batch) and the watchlist use separate
+# pools so that neither queues behind the other.
+RESOURCE_POOL_SIZES = {
+    'request': int(os.environ.get("RESOURCE_LOOKUP_WORKERS", 24)),
+    'watchlist': int(os.environ.get("WATCHLIST_RESOURCE_WORKERS", 8)),
+}
+_resource_executors = {}
+_resource_executors_lock = threading.Lock()
+_resource_sessions = threading.local()
+
+
+def _resource_executor(pool):
+    with _resource_executors_lock:
+        executor = _resource_executors.get(pool)
+        if executor is None:
+            executor = _resource_executors[pool] = ThreadPoolExecutor(
+                max_workers=RESOURCE_POOL_SIZES[pool], thread_name_prefix=f'resources-{pool}')
+        return executor
+
+
+def _with_session(function, *args):
+    session = getattr(_resource_sessions, 'session', None)
+    if session is None:
+        session = _resource_sessions.session = requests.Session()
+    return function(session, *args)
+
+
+class CoinSummaryLookup:
+    """APT balance and coin-store count of one account, fetched concurrently on a resource pool."""
+
+    def __init__(self, address, pool='request'):
+        self.address = address
+        self.cancelled = threading.Event()
+        executor = _resource_executor(pool)
+        self.futures = {
+            'apt_balance': executor.submit(_with_session, get_apt_balance, address),
+            'other_token_count': executor.submit(_with_session, count_other_coin_stores, address, self.cancelled),
+        }
+
+    def result(self, timeout=RESOURCE_LOOKUP_TIMEOUT):
+        """
+        The coin summary dict. A value not ready within `timeout` seconds
+        counts as 0, and its lookup is cancelled (dropped from the queue, or
+        stopped before its next page) so it does not hold a pool thread.
+        """
+        deadline = time.monotonic() + timeout
+        summary = {}
+        for key, future in self.futures.items():
+            try:
+                summary[key] = future.result(timeout=max(0.0, deadline - time.monotonic()))
+            except FutureTimeoutError:
+                print(f"Warning: {key} lookup for {self.address} timed out.")
+                future.cancel()
+                self.cancelled.set()
+                summary[key] = 0
+        return summary
+
+
+def submit_coin_summary(address, pool='request'):
+    """Starts the coin summary lookups of `address` on the given pool; returns a CoinSummaryLookup."""
+    return CoinSummaryLookup(address, pool)
+
+
+# ==============================================================================
+# SECTION 3: COMPACT TRANSACTION STORAGE
+# ==============================================================================
+
+class StringPool:
+    """Interns strings (addresses, contract ids) into dense integer ids."""
+
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+
+    def __len__(self):
+        return len(self.strings)
+
+    def intern(self, value):
+        idx = self.ids.get(value)
+        if idx is None:
+            idx = len(self.strings)
+            self.ids[value] = idx
+            self.strings.append(value)
+        return idx
+
+    def lookup(self, value):
+        """Returns the id of `value`, or -1 if it was never interned."""
+        return self.ids.get(value, -1)
+
+
+def _is_address_argument(arg):
+    return isinstance(arg, str) and arg.startswith('0x') and len(arg) > 40
+
+
+def decode_transaction_page(transactions, pool):
+    """
+    Projects one page of decoded transactions onto the fields the features
+    read, so the full dicts (events, changes, signature, ...) can be dropped
+    right after the page is fetched.
+
+    Returns a tuple of arrays (timestamps, success, sender_ids, contract_ids,
+    arg_counts, arg_ids). Missing senders / functions are stored as -1.
+    """
+    n = len(transactions)
+    timestamps = np.empty(n, dtype=np.int64)
+    success = np.empty(n, dtype=bool)
+    sender_ids = np.full(n, -1, dtype=np.int32)
+    contract_ids = np.full(n, -1, dtype=np.int32)
+    arg_counts = np.zeros(n, dtype=np.int64)
+    arg_ids = []
+
+    for i, tx in enumerate(transactions):
+        timestamps[i] = int(tx['timestamp']) // 1000000
+        success[i] = bool(tx.get('success'))
+        sender = tx.get('sender')
+        if sender:
+            sender_ids[i] = pool.intern(sender)
+        payload = tx.get('payload')
+        if not payload:
+            continue
+        function = payload.get('function')
+        if function:
+            contract_ids[i] = pool.intern(function.split('::')[0])
+        arguments = payload.get('arguments')
+        if arguments:
+            before = len(arg_ids)
+            arg_ids.extend(pool.intern(arg) for arg in arguments if _is_address_argument(arg))
+            arg_counts[i] = len(arg_ids) - before
+
+    return timestamps, success, sender_ids, contract_ids, arg_counts, np.array(arg_ids, dtype=np.int32)
+
+
+class TransactionColumns:
+    """
+    Struct-of-arrays view of a wallet's transactions, in API order.
+
+    Only timestamp (seconds, int64), success (bool), sender, the contract part
+    of payload.function and the address-like payload.arguments are kept.
+    Strings are stored as ids into `pool`. Arguments are ragged, so they live
+    in a flat `arg_ids` array indexed by `arg_offsets` (CSR layout).
+
+    Pages are buffered by `append_page` and merged into the arrays by `compact`.
+    """
+
+    def __init__(self, pool=None):
+        self.pool = pool if pool is not None else StringPool()
+        self.timestamps = np.empty(0, dtype=np.int64)
+        self.success = np.empty(0, dtype=bool)
+        self.sender_ids = np.empty(0, dtype=np.int32)
+        self.contract_ids = np.empty(0, dtype=np.int32)
+        self.arg_offsets = np.zeros(1, dtype=np.int64)
+        self.arg_ids = np.empty(0, dtype=np.int32)
+        self._pending = []
+
+    def __len__(self):
+        return len(self.timestamps) + sum(len(page[0]) for page in self._pending)
+
+    def append_page(self, transactions):
+        self._pending.append(decode_transaction_page(transactions, self.pool))
+
+    def compact(self):
+        """Merges buffered pages into the column arrays."""
+        if not self._pending:
+            return self
+        pages = self._pending
+        self._pending = []
+        self.timestamps = np.concatenate([self.timestamps] + [p[0] for p in pages])
+        self.success = np.concatenate([self.success] + [p[1] for p in pages])
+        self.sender_ids = np.concatenate([self.sender_ids] + [p[2] for p in pages])
+        self.contract_ids = np.concatenate([self.contract_ids] + [p[3] for p in pages])
+        arg_counts = np.concatenate([p[4] for p in pages])
+        self.arg_offsets = np.concatenate([self.arg_offsets, self.arg_offsets[-1] + np.cumsum(arg_counts)])
+        self.arg_ids = np.concatenate([self.arg_ids] + [p[5] for p in pages])
+        return self
+
+    def interacted_contract_ids(self):
+        ids = self.contract_ids
+        return np.unique(ids[ids >= 0])
+
+    def interacted_address_ids(self, exclude=None):
+        ids = np.unique(self.arg_ids)
+        if exclude is not None:
+            exclude_id = self.pool.lookup(exclude)
+            if exclude_id >= 0:
+                ids = ids[ids != exclude_id]
+        return ids
+
+    def counterparties(self, exclude=None):
+        """Addresses of every contract, address argument and sender seen, except `exclude`."""
+        ids = np.unique(np.concatenate([self.contract_ids[self.contract_ids >= 0], self.arg_ids,
+                                        self.sender_ids[self.sender_ids >= 0]]))
+        strings = self.pool.strings
+        return [strings[i] for i in ids.tolist() if strings[i] != exclude]
+
+
+def fetch_transaction_columns(session, address, columns=None):
+    """
+    Fetches a wallet's transactions page by page into a TransactionColumns.
+    When `columns` is given, paging resumes after the rows it already holds.
+    """
+    columns = columns if columns is not None else TransactionColumns()
+    start = len(columns)
     limit = 100
     while True:
         params = {'start': start, 'limit': limit}
@@ -56,7 +311,7 @@ def get_all_transactions(session, address):
             transactions = response.json()
             if not transactions:
                 break
-            all_transactions.extend(transactions)
+            columns.append_page(transactions)
             start += len(transactions)
             if len(transactions) < limit:
                 break
@@ -64,34 +319,16 @@ def get_all_transactions(session, address):
         except requests.exceptions.RequestException:
             print(f"Warning: Could not fetch all transactions for {address}.")
             break
-    return all_transactions
-
-
-def get_wallet_resources(session, address):
-    """Fetches all on-chain resources for a given address."""
-    try:
-        response = session.get(f"{NODE_URL}/accounts/{address}/resources")
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException:
-        return []
+    return columns.compact()
 
 
 # ==============================================================================
-# SECTION 3: MAIN FEATURE ENGINEERING FUNCTION
+# SECTION 4: MAIN FEATURE ENGINEERING FUNCTION
 # ==============================================================================
 
-def create_feature_dataframe(session, address):
-    """
-    Orchestrates data fetching and feature creation for a single wallet address.
-    Returns a pandas DataFrame ready for the prediction pipeline.
-    """
-    print(f"  - Fetching transactions and resources for {address[:10]}...")
-    all_transactions = get_all_transactions(session, address)
-    resources = get_wallet_resources(session, address)
-
-    # Initialize a dictionary with default values for all features
-    profile = {
+def default_profile():
+    """Feature values used for a wallet without any transactions."""
+    return {
         'wallet_age_days': 0, 'apt_balance': 0, 'other_token_count': 0,
         'total_transaction_count': 0, 'successful_transaction_count': 0, 'failed_transaction_count': 0,
         'unique_interacted_contracts': 0, 'unique_interacted_addresses': 0,
@@ -101,62 +338,88 @@ def create_feature_dataframe(session, address):
         'success_rate': 0, 'new_contract_rate': 0, 'balance_per_tx': 0
     }
 
-    if not all_transactions:
+
+def _most_active_hour(timestamps):
+    """Most common UTC hour; ties go to the hour seen first, like Counter.most_common."""
+    hours = (timestamps // 3600) % 24
+    counts = np.bincount(hours, minlength=24)
+    candidates = np.flatnonzero(counts == counts.max())
+    if len(candidates) == 1:
+        return int(candidates[0])
+    return int(hours[np.argmax(np.isin(hours, candidates))])
+
+
+def compute_features(address, columns, coin_summary):
+    """
+    Computes the feature profile (a dict) of a wallet from its transaction
+    columns and its coin summary (see get_coin_summary).
+    """
+    profile = default_profile()
+
+    if len(columns) == 0:
         print(f"  - WARNING: No transactions found for wallet {address}. Returning default profile.")
-        return pd.DataFrame([profile])
+        return profile
 
     # --- Start Feature Calculation ---
-    profile['total_transaction_count'] = len(all_transactions)
-    profile['successful_transaction_count'] = sum(1 for tx in all_transactions if tx.get('success'))
+    profile['total_transaction_count'] = len(columns)
+    profile['successful_transaction_count'] = int(np.count_nonzero(columns.success))
     profile['failed_transaction_count'] = profile['total_transaction_count'] - profile['successful_transaction_count']
 
     # Temporal features
-    first_tx = all_transactions[-1]
-    first_tx_timestamp = int(first_tx['timestamp']) // 1000000
+    first_tx_timestamp = int(columns.timestamps[-1])
     creation_datetime = datetime.fromtimestamp(first_tx_timestamp, tz=timezone.utc)
     profile['wallet_age_days'] = (datetime.now(timezone.utc) - creation_datetime).days
     profile['tx_day_of_week'] = creation_datetime.weekday()  # Monday=0, Sunday=6
     profile['tx_month'] = creation_datetime.month
     profile['tx_day_of_month'] = creation_datetime.day
 
-    timestamps = sorted([int(tx['timestamp']) // 1000000 for tx in all_transactions])
+    timestamps = np.sort(columns.timestamps)
     if len(timestamps) > 1:
         time_diffs = np.diff(timestamps)
         profile['avg_time_between_tx_seconds'] = float(np.mean(time_diffs))
         profile['std_dev_time_between_tx_seconds'] = float(np.std(time_diffs))
 
-    hours = [datetime.fromtimestamp(ts, tz=timezone.utc).hour for ts in timestamps]
-    if hours:
-        profile['most_active_hour'] = collections.Counter(hours).most_common(1)[0][0]
+    profile['most_active_hour'] = _most_active_hour(timestamps)
 
     # Funding and balance features
-    if first_tx.get('sender') != address:
+    address_id = columns.pool.lookup(address)
+    if address_id < 0 or columns.sender_ids[-1] != address_id:
         profile['is_self_funded'] = 0
 
-    apt_balance = 0
-    other_token_count = 0
-    for resource in resources:
-        if resource.get('type') == '0x1::coin::CoinStore<0x1::aptos_coin::AptosCoin>':
-            apt_balance = int(resource['data']['coin']['value']) / 10 ** 8
-        elif resource.get('type', '').startswith('0x1::coin::CoinStore<'):
-            other_token_count += 1
-    profile['apt_balance'] = apt_balance
-    profile['other_token_count'] = other_token_count
+    profile['apt_balance'] = coin_summary['apt_balance']
+    profile['other_token_count'] = coin_summary['other_token_count']
 
     # Interaction features
-    interacted_contracts = {tx['payload']['function'].split('::')[0] for tx in all_transactions if
-                            tx.get('payload') and tx['payload'].get('function')}
-    profile['unique_interacted_contracts'] = len(interacted_contracts)
-
-    interacted_addresses = {arg for tx in all_transactions if tx.get('payload') and tx['payload'].get('arguments') for
-                            arg in tx['payload']['arguments'] if
-                            isinstance(arg, str) and arg.startswith('0x') and len(arg) > 40}
-    profile['unique_interacted_addresses'] = len(interacted_addresses - {address})
+    profile['unique_interacted_contracts'] = len(columns.interacted_contract_ids())
+    profile['unique_interacted_addresses'] = len(columns.interacted_address_ids(exclude=address))
 
     # Ratio features
     profile['success_rate'] = profile['successful_transaction_count'] / (profile['total_transaction_count'] + 1e-6)
     profile['new_contract_rate'] = profile['unique_interacted_contracts'] / (profile['total_transaction_count'] + 1e-6)
     profile['balance_per_tx'] = profile['apt_balance'] / (profile['total_transaction_count'] + 1e-6)
 
-    print(f"  - Successfully created feature profile for {address[:10]}...")
-    return pd.DataFrame([profile])
\ No newline at end of file
+    return profile
+
+
+def create_feature_profile(session, address, counterparty_index=None):
+    """
+    Orchestrates data fetching and feature creation for a single wallet address.
+    Returns the feature profile as a dict. When a CounterpartyIndex is given,
+    the wallet's counterparties are added to it.
+    """
+    print(f"  - Fetching transactions and resources for {address[:10]}...")
+    coin_summary = submit_coin_summary(address)
+    columns = fetch_transaction_columns(session, address)
+    if counterparty_index is not None:
+        counterparty_index.add_wallet(address, columns.counterparties(exclude=address))
+
+    profile = compute_features(address, columns, coin_summary.result())
+    if len(columns):
+        print(f"  - Successfully created feature profile for {address[:10]}...")
+    return profile
+
+
+def create_feature_dataframe(session, address):
+    """Same as create_feature_profile, as a one-row DataFrame ready for the prediction pipeline."""
+    import pandas as pd
+    return pd.DataFrame([create_feature_profile(session, address)])
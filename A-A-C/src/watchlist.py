@@ -0,0 +1,241 @@
+# src/watchlist.py
+# Background re-scoring of a known set of wallets (token deployers, pool
+# creators, frequent counterparties) so /predict can answer them from cache.
+
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock
+    fcntl = None
+
+import requests
+
+try:
+    from src.utils import fetch_transaction_columns, submit_coin_summary, compute_features
+except ImportError:
+    from utils import fetch_transaction_columns, submit_coin_summary, compute_features
+
+
+class WatchedWallet:
+    """Scheduling state of one watched wallet."""
+
+    def __init__(self, address):
+        self.address = address
+        self.columns = None  # TransactionColumns kept between refreshes for incremental fetching
+        self.last_scored = None
+        self.last_attempt = None
+        self.recent_activity = 0  # new transactions seen in the last refresh
+
+    def priority(self, now):
+        """Higher is more urgent: stale wallets first, boosted by recent activity."""
+        if self.last_scored is None:
+            return math.inf
+        staleness = now - self.last_scored
+        return staleness * (1 + math.log1p(self.recent_activity))
+
+
+class WatchlistFile:
+    """
+    Watchlist shared by all worker processes: a text file with one address
+    per line. Changes are made under an exclusive lock on `<path>.lock` and
+    written atomically; each worker's scheduler polls the file for changes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def read(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return {line.strip() for line in f if line.strip()}
+        except FileNotFoundError:
+            return set()
+
+    def version(self):
+        """Changes whenever the file is rewritten (None if it does not exist)."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def update(self, add=(), remove=(), only_if_missing=False, max_size=None):
+        """
+        Adds/removes addresses and returns the new set of addresses. Raises
+        ValueError (leaving the file unchanged) if the result would hold more
+        than `max_size` addresses.
+        """
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        with open(f'{self.path}.lock', 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            addresses = self.read()
+            if only_if_missing and os.path.exists(self.path):
+                return addresses
+            addresses = (addresses | set(add)) - set(remove)
+            if max_size is not None and len(addresses) > max_size:
+                raise ValueError(f'Watchlist would hold {len(addresses)} wallets (max {max_size})')
+            tmp_path = f'{self.path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.writelines(f'{address}\n' for address in sorted(addresses))
+            os.replace(tmp_path, self.path)
+            return addresses
+
+
+class WatchlistScheduler:
+    """
+    Keeps a watchlist of wallets and re-scores them on a background thread.
+
+    Every `tick_seconds` the wallets whose last refresh is older than
+    `refresh_seconds` are ordered by priority and at most `max_concurrency`
+    of them are refreshed at once. Transactions are fetched incrementally
+    (only pages after the ones already held), and each result from
+    `score_fn(address, profile)` is published to `cache`. Counterparties are
+    fed to `counterparty_index` when one is given.
+
+    The scheduler and cache live in one process. With a `watchlist_file`
+    the set of wallets is kept in sync with that file on every tick, so
+    every gunicorn worker watches the same wallets.
+    """
+
+    def __init__(self, score_fn, cache, refresh_seconds=300, max_concurrency=4, tick_seconds=1.0,
+                 counterparty_index=None, watchlist_file=None):
+        self.score_fn = score_fn
+        self.cache = cache
+        self.counterparty_index = counterparty_index
+        self.watchlist_file = watchlist_file
+        self._file_version = None
+        self.refresh_seconds = refresh_seconds
+        self.max_concurrency = max_concurrency
+        self.tick_seconds = tick_seconds
+        self._wallets = {}
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._executor = None
+        self._local = threading.local()
+
+    def __contains__(self, address):
+        return address in self._wallets
+
+    def add(self, addresses):
+        with self._lock:
+            for address in addresses:
+                if address not in self._wallets:
+                    self._wallets[address] = WatchedWallet(address)
+
+    def remove(self, addresses):
+        with self._lock:
+            for address in addresses:
+                self._wallets.pop(address, None)
+                self.cache.discard(address)
+
+    def sync(self):
+        """Makes the watched wallets match the watchlist file, if it changed since the last sync."""
+        if self.watchlist_file is None:
+            return
+        version = self.watchlist_file.version()
+        if version == self._file_version:
+            return
+        self._file_version = version
+        addresses = self.watchlist_file.read()
+        with self._lock:
+            removed = [address for address in self._wallets if address not in addresses]
+        self.remove(removed)
+        self.add(addresses)
+
+    def status(self):
+        now = time.monotonic()
+        with self._lock:
+            wallets = list(self._wallets.values())
+            in_flight = len(self._in_flight)
+        return {
+            'running': self._thread is not None and self._thread.is_alive(),
+            'watched': len(wallets),
+            'scored': sum(1 for w in wallets if w.last_scored is not None),
+            'in_flight': in_flight,
+            'max_concurrency': self.max_concurrency,
+            'refresh_seconds': self.refresh_seconds,
+            'oldest_score_age_seconds': max((now - w.last_scored for w in wallets if w.last_scored is not None),
+                                            default=None),
+            'worker_pid': os.getpid(),
+            'watchlist_file': self.watchlist_file.path if self.watchlist_file is not None else None,
+        }
+
+    def start(self):
+        """Starts the scheduler thread; calling it again is a no-op."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency,
+                                                thread_name_prefix='watchlist')
+            self._thread = threading.Thread(target=self._run, name='watchlist-scheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sync()
+            except OSError as e:
+                print(f"Warning: Could not read watchlist file: {e}")
+            for wallet in self._due_wallets():
+                self._executor.submit(self._refresh, wallet)
+            self._stop.wait(self.tick_seconds)
+
+    def _due_wallets(self):
+        now = time.monotonic()
+        with self._lock:
+            budget = self.max_concurrency - len(self._in_flight)
+            if budget <= 0:
+                return []
+            due = [w for w in self._wallets.values()
+                   if w.address not in self._in_flight
+                   and (w.last_attempt is None or now - w.last_attempt >= self.refresh_seconds)]
+            due.sort(key=lambda w: w.priority(now), reverse=True)
+            due = due[:budget]
+            for wallet in due:
+                self._in_flight.add(wallet.address)
+                wallet.last_attempt = now
+        return due
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def _refresh(self, wallet):
+        try:
+            session = self._session()
+            coin_summary = submit_coin_summary(wallet.address, pool='watchlist')
+            before = len(wallet.columns) if wallet.columns is not None else 0
+            wallet.columns = fetch_transaction_columns(session, wallet.address, wallet.columns)
+            wallet.recent_activity = len(wallet.columns) - before
+            if self.counterparty_index is not None and wallet.recent_activity:
+                self.counterparty_index.add_wallet(wallet.address, wallet.columns.counterparties(exclude=wallet.address))
+            profile = compute_features(wallet.address, wallet.columns, coin_summary.result())
+            result = self.score_fn(wallet.address, profile)
+            # Skip the cache if the wallet was removed (or removed and re-added) while it was being scored
+            with self._lock:
+                if self._wallets.get(wallet.address) is wallet:
+                    self.cache.put(wallet.address, result)
+            wallet.last_scored = time.monotonic()
+        except Exception as e:
+            print(f"Warning: Could not re-score watched wallet {wallet.address}: {e}")
+        finally:
+            with self._lock:
+                self._in_flight.discard(wallet.address)
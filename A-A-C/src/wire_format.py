@@ -0,0 +1,57 @@
+# src/wire_format.py
+# Content negotiation for the predict endpoints: request and response bodies
+# are MessagePack when the client asks for it (and msgpack is installed),
+# JSON otherwise.
+
+from flask import Response, jsonify, request
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_MIMETYPE = 'application/json'
+MSGPACK_MIMETYPES = ('application/msgpack', 'application/x-msgpack')
+
+
+def _to_builtin(value):
+    """msgpack fallback for NumPy scalars and arrays."""
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError(f'Cannot serialize {type(value).__name__}')
+
+
+def is_msgpack_request():
+    return request.mimetype in MSGPACK_MIMETYPES
+
+
+def unsupported_media_type():
+    """415 response for a MessagePack body when msgpack is not installed, or None."""
+    if is_msgpack_request() and msgpack is None:
+        return jsonify({'error': 'MessagePack is not supported by this server, send JSON'}), 415
+    return None
+
+
+def request_body():
+    """Decoded request body (MessagePack or JSON), or None when it is missing or malformed."""
+    if is_msgpack_request():
+        try:
+            return msgpack.unpackb(request.get_data(cache=False), raw=False)
+        except ValueError:  # also covers msgpack FormatError, ExtraData, StackError
+            return None
+    return request.get_json(silent=True)
+
+
+def respond(payload, status=200):
+    """
+    Encodes `payload` as MessagePack when the Accept header prefers it (or,
+    without an Accept header, when the request itself was MessagePack), and
+    as JSON otherwise.
+    """
+    mimetype = None
+    if msgpack is not None:
+        offered = [*MSGPACK_MIMETYPES, JSON_MIMETYPE] if is_msgpack_request() else [JSON_MIMETYPE, *MSGPACK_MIMETYPES]
+        mimetype = request.accept_mimetypes.best_match(offered) if request.accept_mimetypes else offered[0]
+    if mimetype in MSGPACK_MIMETYPES:
+        return Response(msgpack.packb(payload, default=_to_builtin), status=status, mimetype=mimetype)
+    return jsonify(payload), status
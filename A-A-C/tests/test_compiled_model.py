@@ -0,0 +1,36 @@
+# tests/test_compiled_model.py
+# Run from A-A-C/: python -m pytest tests
+
+import numpy as np
+import pandas as pd
+from lightgbm import LGBMClassifier
+from sklearn.compose import ColumnTransformer
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+from src.export_compiled_model import compile_sybil_pipeline
+
+
+COLUMNS = ['a', 'b', 'c']
+
+
+def fit_pipeline_without_imputer():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(500, 3))
+    y = (X[:, 0] + 0.5 * X[:, 1] > 0.3).astype(int)
+    pipeline = Pipeline([
+        ('preprocessor', ColumnTransformer([('num', StandardScaler(), COLUMNS)])),
+        ('model', LGBMClassifier(n_estimators=30, num_leaves=8, verbose=-1)),
+    ])
+    return pipeline.fit(pd.DataFrame(X, columns=COLUMNS), y)
+
+
+def test_nan_goes_to_zero_at_splits_without_missing_type():
+    # Trained without NaN, so every split has missing type None
+    pipeline = fit_pipeline_without_imputer()
+    compiled = compile_sybil_pipeline(pipeline)
+
+    X = np.random.default_rng(1).normal(size=(200, 3))
+    X[np.random.default_rng(2).random(X.shape) < 0.3] = np.nan
+    X[0] = [np.nan, 0.0, 0.0]
+    np.testing.assert_allclose(compiled.predict_proba(X), pipeline.predict_proba(pd.DataFrame(X, columns=COLUMNS)), atol=1e-12)
@@ -0,0 +1,117 @@
+# tests/test_counterparty_index.py
+# Run from A-A-C/: python -m pytest tests
+
+import time
+
+import numpy as np
+import pytest
+
+from src.counterparty_index import CounterpartyIndex
+
+
+def reference_clusters(wallet_cps, max_hub_degree):
+    """Cluster size of every wallet by BFS over counterparties with at most `max_hub_degree` wallets."""
+    by_cp = {}
+    for wallet, cps in wallet_cps.items():
+        for cp in set(cps) - {wallet}:
+            by_cp.setdefault(cp, set()).add(wallet)
+    sizes = {}
+    for start in wallet_cps:
+        if start in sizes:
+            continue
+        seen, todo = {start}, [start]
+        while todo:
+            wallet = todo.pop()
+            for cp in wallet_cps[wallet]:
+                linked = by_cp.get(cp, set())
+                if len(linked) <= max_hub_degree:
+                    todo += [w for w in linked if w not in seen]
+                    seen |= linked
+        for wallet in seen:
+            sizes[wallet] = len(seen)
+    return sizes
+
+
+def wait_for_clusters(index, timeout=10):
+    """Waits until the background thread has rebuilt the clusters."""
+    deadline = time.monotonic() + timeout
+    while index._clusters_stale():
+        assert time.monotonic() < deadline, 'clusters were not rebuilt'
+        time.sleep(0.01)
+
+
+def test_hub_does_not_link_wallets_it_reached_before_the_cap():
+    index = CounterpartyIndex(max_hub_degree=50)
+    for i in range(60):
+        index.add_wallet(f'0xw{i}', ['0x1', f'0xprivate{i}'])
+
+    features = index.cluster_features('0xw0')
+    assert features['cluster_size'] == 1
+    assert features['wallets_sharing_counterparties'] == 0
+    assert index.cluster_features('0xw59')['cluster_size'] == 1
+
+
+def test_clusters_below_the_cap_are_kept():
+    index = CounterpartyIndex(max_hub_degree=50)
+    for i in range(10):
+        index.add_wallet(f'0xw{i}', ['0xfunder', f'0xprivate{i}'])
+    index.add_wallet('0xother', ['0xprivate0'])
+
+    features = index.cluster_features('0xw3')
+    assert features['cluster_size'] == 11
+    assert features['wallets_sharing_counterparties'] == 9
+    assert index.wallets_sharing('0xother') == [('0xw0', 1)]
+
+
+@pytest.mark.parametrize('background', [False, True])
+def test_clusters_match_reference_on_random_graph(background):
+    rng = np.random.default_rng(0)
+    index = CounterpartyIndex(max_hub_degree=8, compact_every=500)
+    if background:
+        index.start()  # rebuilds and compactions run while wallets are being added
+    wallet_cps = {}
+    for i in range(400):
+        wallet = f'0xw{i}'
+        cps = [f'0xc{c}' for c in rng.integers(0, 300, size=rng.integers(1, 6))]
+        if i % 3 == 0:
+            cps.append('0xrouter')
+        wallet_cps.setdefault(wallet, []).extend(cps)
+        index.add_wallet(wallet, cps)
+        if i % 97 == 0:  # extend a few wallets later
+            extra = [f'0xc{c}' for c in rng.integers(0, 300, size=2)]
+            wallet_cps[f'0xw{i // 2}'].extend(extra)
+            index.add_wallet(f'0xw{i // 2}', extra)
+
+    if background:
+        wait_for_clusters(index)
+    expected = reference_clusters(wallet_cps, max_hub_degree=8)
+    for wallet, size in expected.items():
+        assert index.cluster_features(wallet)['cluster_size'] == size, wallet
+
+
+def test_background_thread_rebuilds_after_hub_crossing():
+    index = CounterpartyIndex(max_hub_degree=50)
+    index.start()
+    for i in range(60):
+        index.add_wallet(f'0xw{i}', ['0x1', f'0xprivate{i}'])
+
+    wait_for_clusters(index)
+    assert index.cluster_features('0xw0')['cluster_size'] == 1
+
+
+def test_save_merges_edges_of_other_workers(tmp_path):
+    path = str(tmp_path / 'counterparty_index.npz')
+    first, second = CounterpartyIndex(), CounterpartyIndex()
+    first.add_wallet('0xa', ['0xfunder'])
+    second.add_wallet('0xb', ['0xfunder'])
+    first.save(path)
+    second.save(path)
+
+    assert second.cluster_features('0xa')['cluster_size'] == 2
+    loaded = CounterpartyIndex.load(path)
+    assert loaded.wallets_sharing('0xa') == [('0xb', 1)]
+    assert loaded.status()['edges'] == 2
+
+    first.sync(path)  # not dirty: picks up the second worker's edges
+    assert first.wallets_sharing('0xa') == [('0xb', 1)]
+    assert not first.dirty
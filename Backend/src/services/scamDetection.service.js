@@ -1,16 +1,69 @@
 const axios = require('axios');
+const http = require('http');
+const https = require('https');
 const { logger } = require('../utils/logger');
 
+// MessagePack is optional: without the package the service speaks JSON only
+let msgpack = null;
+try {
+  msgpack = require('@msgpack/msgpack');
+} catch (error) {
+  msgpack = null;
+}
+
+const MSGPACK_TYPE = 'application/msgpack';
+
 class ScamDetectionService {
   constructor() {
     this.riskThreshold = 70;
     this.aiServiceUrl = process.env.AI_SERVICE_URL || '';
+    this.batchSize = parseInt(process.env.AI_SERVICE_BATCH_SIZE, 10) || 50;
+    this.useMsgpack = Boolean(msgpack) && process.env.AI_SERVICE_MSGPACK !== 'false';
+
+    // Keep-alive agents so consecutive requests reuse the same connections
+    this.httpClient = axios.create({
+      httpAgent: new http.Agent({ keepAlive: true, maxSockets: 16 }),
+      httpsAgent: new https.Agent({ keepAlive: true, maxSockets: 16 }),
+    });
     
     if (!this.aiServiceUrl) {
       logger.warn('AI_SERVICE_URL is not set. Using fallback scam detection.');
     }
   }
 
+  async postToAI(path, body, timeout) {
+    const useMsgpack = this.useMsgpack;
+    try {
+      const response = await this.httpClient.post(`${this.aiServiceUrl}${path}`,
+        useMsgpack ? Buffer.from(msgpack.encode(body)) : body, {
+          timeout,
+          responseType: 'arraybuffer',
+          headers: {
+            'Content-Type': useMsgpack ? MSGPACK_TYPE : 'application/json',
+            'Accept': useMsgpack ? `${MSGPACK_TYPE}, application/json;q=0.9` : 'application/json'
+          }
+        });
+      return this.decodeAIResponse(response);
+    } catch (error) {
+      // The AI service answers 415 when it has no MessagePack support: switch to JSON
+      if (useMsgpack && error.response && error.response.status === 415) {
+        logger.warn('AI service does not accept MessagePack. Falling back to JSON.');
+        this.useMsgpack = false;
+        return this.postToAI(path, body, timeout);
+      }
+      throw error;
+    }
+  }
+
+  decodeAIResponse(response) {
+    const contentType = response.headers['content-type'] || '';
+    const data = Buffer.from(response.data);
+    if (msgpack && /msgpack/.test(contentType)) {
+      return msgpack.decode(data);
+    }
+    return JSON.parse(data.toString('utf8'));
+  }
+
   async analyzeToken(tokenAddress, tokenName = '', tokenSymbol = '') {
     try {
       if (this.aiServiceUrl) {
@@ -24,30 +77,27 @@ class ScamDetectionService {
     }
   }
 
+  toAnalysisResult(aiData, tokenAddress) {
+    return {
+      tokenAddress: aiData.wallet_address || tokenAddress,
+      isScam: aiData.prediction === 'Sybil',
+      riskScore: Math.round((aiData.sybil_probability || 0) * 100),
+      confidence: Math.round((aiData.confidence || 0.5) * 100),
+      reasons: [
+        `AI Prediction: ${aiData.prediction || 'Unknown'}`,
+        `Sybil Probability: ${Math.round((aiData.sybil_probability || 0) * 100)}%`
+      ],
+      checkedAt: new Date(),
+    };
+  }
+
   async analyzeWithAI(tokenAddress) {
     try {
-      const response = await axios.post(`${this.aiServiceUrl}/predict`, {
+      const aiData = await this.postToAI('/predict', {
         wallet_address: tokenAddress,
-      }, {
-        timeout: 10000, // 10 second timeout
-        headers: {
-          'Content-Type': 'application/json'
-        }
-      });
+      }, 10000); // 10 second timeout
 
-      const aiData = response.data;
-
-      const analysisResult = {
-        tokenAddress: aiData.wallet_address || tokenAddress,
-        isScam: aiData.prediction === 'Sybil',
-        riskScore: Math.round((aiData.sybil_probability || 0) * 100),
-        confidence: Math.round((aiData.confidence || 0.5) * 100),
-        reasons: [
-          `AI Prediction: ${aiData.prediction || 'Unknown'}`,
-          `Sybil Probability: ${Math.round((aiData.sybil_probability || 0) * 100)}%`
-        ],
-        checkedAt: new Date(),
-      };
+      const analysisResult = this.toAnalysisResult(aiData, tokenAddress);
 
       logger.info(`AI analysis completed for ${tokenAddress}: Risk Score ${analysisResult.riskScore}`);
       return analysisResult;
@@ -185,8 +235,37 @@ class ScamDetectionService {
     return 90;
   }
 
+  async batchAnalyzeWithAI(addresses) {
+    const results = [];
+    for (let i = 0; i < addresses.length; i += this.batchSize) {
+      const chunk = addresses.slice(i, i + this.batchSize);
+      try {
+        const aiData = await this.postToAI('/predict/batch', {
+          wallet_addresses: chunk,
+        }, 10000 + 1000 * chunk.length);
+
+        const chunkResults = await Promise.all(aiData.results.map((item, index) => (
+          item.error
+            ? this.analyzeWithFallback(chunk[index], '', '')
+            : this.toAnalysisResult(item, chunk[index])
+        )));
+        results.push(...chunkResults);
+      } catch (error) {
+        logger.error(`Error calling AI batch endpoint for ${chunk.length} addresses:`, error.message);
+        results.push(...await Promise.all(chunk.map(addr => this.analyzeWithFallback(addr, '', ''))));
+      }
+    }
+
+    logger.info(`AI batch analysis completed for ${addresses.length} addresses`);
+    return results;
+  }
+
   async batchAnalyze(addresses) {
     try {
+      if (this.aiServiceUrl) {
+        return await this.batchAnalyzeWithAI(addresses);
+      }
+
       const results = await Promise.allSettled(
         addresses.map(addr => this.analyzeToken(addr))
       );
@@ -217,6 +296,7 @@ class ScamDetectionService {
       service: 'ScamDetectionService',
       status: this.aiServiceUrl ? 'AI-enabled' : 'Fallback-mode',
       aiServiceUrl: this.aiServiceUrl ? 'configured' : 'not-configured',
+      wireFormat: this.useMsgpack ? 'msgpack' : 'json',
       riskThreshold: this.riskThreshold
     };
   }